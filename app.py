@@ -1,23 +1,33 @@
 import os
 import logging
+import hashlib
 from datetime import datetime
 from io import StringIO
 import csv
 
+import orjson
+
 from flask import (
     Flask, render_template, redirect, url_for, request, flash, 
-    session, abort, jsonify, send_file
+    session, abort, Response, stream_with_context, make_response
 )
 from flask_sqlalchemy import SQLAlchemy
+from flask_caching import Cache
+from flask_compress import Compress
 from flask_login import (
     LoginManager, UserMixin, login_user, logout_user,
     login_required, current_user
 )
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy import lambda_stmt, select, text, tuple_
+from sqlalchemy.orm import DeclarativeBase, raiseload
 
 # Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Log level comes from LOG_LEVEL (DEBUG only by default in development)
+_default_log_level = 'DEBUG' if os.environ.get('FLASK_ENV') == 'development' else 'INFO'
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', _default_log_level).upper())
+# SQLAlchemy per-statement logging is far too chatty for the request path
+logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
 
 # Setup SQLAlchemy with new API
 class Base(DeclarativeBase):
@@ -34,13 +44,38 @@ if not app.secret_key:
 # Configure database
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///booking_inquiries.db")
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
+    "pool_recycle": 1800,
     "pool_pre_ping": True,
 }
+if not app.config["SQLALCHEMY_DATABASE_URI"].startswith("sqlite"):
+    # Size the pool for concurrent DataTables polling (roughly gunicorn workers * threads)
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update({
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 20)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 40)),
+        "pool_timeout": 30,
+    })
+if app.config["SQLALCHEMY_DATABASE_URI"].startswith(("postgres://", "postgresql")):
+    # Abort runaway queries server-side instead of holding a pooled connection
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"]["connect_args"] = {"options": "-c statement_timeout=30000"}
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["SQLALCHEMY_RECORD_QUERIES"] = False
+app.config["SQLALCHEMY_ECHO"] = False
+
+# Configure caching (SimpleCache per process by default, RedisCache in prod)
+app.config["CACHE_TYPE"] = os.environ.get("CACHE_TYPE", "SimpleCache")
+app.config["CACHE_REDIS_URL"] = os.environ.get("REDIS_URL")
+app.config["CACHE_DEFAULT_TIMEOUT"] = 30
+
+# Compress JSON/CSV/HTML responses (the DataTables payload and CSV export are highly repetitive)
+app.config["COMPRESS_MIMETYPES"] = ["application/json", "text/csv", "text/html"]
+app.config["COMPRESS_LEVEL"] = 5
+app.config["COMPRESS_MIN_SIZE"] = 500
+app.config["COMPRESS_STREAMING"] = True  # Compress the streamed CSV export chunk by chunk
 
 # Initialize extensions
 db.init_app(app)
+cache = Cache(app)
+Compress(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -49,10 +84,8 @@ login_manager.login_message_category = 'info'
 # Import models after initializing db to avoid circular imports
 from models import User, Inquiry
 
-# Create all database tables
-with app.app_context():
-    db.create_all()
-    # Create default admin user if not exists (only if admin credentials are provided)
+def create_admin_user():
+    """Create the default admin user from ADMIN_* environment variables if it doesn't exist."""
     admin_username = os.environ.get('ADMIN_USERNAME')
     admin_password = os.environ.get('ADMIN_PASSWORD') 
     admin_email = os.environ.get('ADMIN_EMAIL')
@@ -70,9 +103,120 @@ with app.app_context():
     else:
         print("WARNING: Admin user not created. Set ADMIN_USERNAME, ADMIN_PASSWORD, and ADMIN_EMAIL environment variables to create an admin user.")
 
+@app.cli.command('init-admin')
+def init_admin_command():
+    """Create database tables and the default admin user (run once at deploy time)."""
+    db.create_all()
+    create_admin_user()
+
+# Schema/admin bootstrap is a deploy step (`flask init-admin`); only run it on
+# import when explicitly requested so every worker doesn't repeat it on boot
+if os.environ.get('RUN_DB_INIT') == '1':
+    with app.app_context():
+        db.create_all()
+        create_admin_user()
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    if not isinstance(user_id, str) or not user_id.isdigit():
+        return None
+    return db.session.get(User, int(user_id))
+
+@cache.memoize(timeout=30)
+def _status_counts():
+    """Return a {status: count} dict for all inquiries, cached for a short TTL."""
+    rows = db.session.query(Inquiry.status, db.func.count(Inquiry.id)).group_by(Inquiry.status).all()
+    return dict(rows)
+
+@cache.memoize(timeout=60)
+def approx_inquiry_count():
+    """Return a cheap row-count estimate for the inquiry table.
+
+    On PostgreSQL this reads the planner statistics in pg_class instead of
+    scanning the table; other backends (and never-analyzed tables) fall back
+    to an exact COUNT.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        estimate = db.session.execute(
+            text("SELECT reltuples::BIGINT FROM pg_class WHERE relname = :table_name"),
+            {'table_name': Inquiry.__tablename__}
+        ).scalar()
+        if estimate is not None and estimate >= 0:
+            return estimate
+    return db.session.query(db.func.count(Inquiry.id)).scalar()
+
+_SEARCH_COLUMNS = (Inquiry.first_name, Inquiry.last_name, Inquiry.email, Inquiry.phone, Inquiry.status)
+
+def _search_document():
+    """Concatenate the searchable inquiry columns into a single text expression.
+
+    SQLite only has concat_ws from 3.44, so other backends join the columns with ||.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.concat_ws(' ', *_SEARCH_COLUMNS)
+    document = db.func.coalesce(_SEARCH_COLUMNS[0], '')
+    for column in _SEARCH_COLUMNS[1:]:
+        document = document + ' ' + db.func.coalesce(column, '')
+    return document
+
+def _search_predicate(search_value):
+    """Build the DataTables search filter.
+
+    On PostgreSQL this is a full-text match that an expression GIN index on
+    to_tsvector('simple', <search document>) can serve; other backends fall
+    back to a single case-insensitive substring match.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        document = db.func.to_tsvector('simple', _search_document())
+        return document.op('@@')(db.func.plainto_tsquery('simple', search_value))
+    return _search_document().ilike(f'%{search_value}%')
+
+def _listing_columns():
+    """Return the inquiry table columns, formatted for display by the database.
+
+    PostgreSQL uses to_char; the SQLite development database uses strftime/printf.
+    """
+    client_name = db.func.trim(
+        db.func.coalesce(Inquiry.first_name, '') + ' ' + db.func.coalesce(Inquiry.last_name, '')
+    )
+    travel_dates = db.case(
+        (db.and_(Inquiry.travel_start != '', Inquiry.travel_end != ''),
+         Inquiry.travel_start + ' to ' + Inquiry.travel_end),
+        else_=''
+    )
+    if db.engine.dialect.name == 'postgresql':
+        date_received = db.func.to_char(Inquiry.date_received, 'YYYY-MM-DD HH24:MI')
+        trip_cost = '$' + db.func.to_char(Inquiry.trip_cost, 'FM999999990.00', type_=db.String)
+    else:
+        date_received = db.func.strftime('%Y-%m-%d %H:%M', Inquiry.date_received)
+        trip_cost = db.func.printf('$%.2f', Inquiry.trip_cost)
+    trip_cost = db.case((db.func.coalesce(Inquiry.trip_cost, 0) != 0, trip_cost), else_='')
+    return (
+        Inquiry.id,
+        date_received.label('date_received'),
+        client_name.label('client_name'),
+        Inquiry.email,
+        Inquiry.phone,
+        travel_dates.label('travel_dates'),
+        trip_cost.label('trip_cost'),
+        Inquiry.status,
+    )
+
+def _parse_cursor_value(column_name, raw_value):
+    """Convert a keyset cursor value from the client back to the column's Python type."""
+    if column_name == 'date_received':
+        return datetime.fromisoformat(raw_value)
+    if column_name == 'id':
+        return int(raw_value)
+    if column_name == 'trip_cost':
+        return float(raw_value)
+    return raw_value
+
+def _serialize_cursor_value(value):
+    """Convert a sort column value to a string the client can echo back as a cursor."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
 
 # Routes
 @app.route('/')
@@ -112,13 +256,29 @@ def dashboard():
     status_filter = request.args.get('status', '')
     search_query = request.args.get('search', '')
     
-    # Get counts for dashboard stats
-    total_count = Inquiry.query.count()
-    complete_count = Inquiry.query.filter_by(status='Complete').count()
-    incomplete_count = Inquiry.query.filter_by(status='Incomplete').count()
-    error_count = Inquiry.query.filter_by(status='Error').count()
-    
-    return render_template(
+    # Get counts for dashboard stats (single grouped query, cached)
+    counts = _status_counts()
+    total_count = sum(counts.values())
+    complete_count = counts.get('Complete', 0)
+    incomplete_count = counts.get('Incomplete', 0)
+    error_count = counts.get('Error', 0)
+
+    # The page only varies by user and status counts (the table loads via AJAX),
+    # so polling clients can revalidate with If-None-Match and get a 304.
+    # Pages with pending flash messages are never treated as unchanged.
+    etag = None
+    if '_flashes' not in session:
+        etag = hashlib.md5(
+            f"{current_user.get_id()}:{sorted(counts.items())}".encode()
+        ).hexdigest()
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.cache_control.private = True
+            response.cache_control.max_age = 10
+            return response
+
+    response = make_response(render_template(
         'dashboard.html', 
         title='Booking Inquiry Dashboard',
         status_filter=status_filter,
@@ -127,7 +287,12 @@ def dashboard():
         complete_count=complete_count,
         incomplete_count=incomplete_count,
         error_count=error_count
-    )
+    ))
+    if etag:
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.max_age = 10
+    return response
 
 @app.route('/api/inquiries')
 @login_required
@@ -145,82 +310,121 @@ def get_inquiries():
     columns = ['id', 'date_received', 'first_name', 'last_name', 'email', 'phone', 
                'travel_start', 'travel_end', 'trip_cost', 'status']
     
-    # Query base
-    query = Inquiry.query
+    # Query base: select only the columns the table needs, already formatted by the database.
+    # lambda_stmt caches the compiled SQL per statement shape, so only the
+    # parameter values are re-extracted on each request.
+    stmt = lambda_stmt(lambda: select(*_listing_columns()))
     
-    # Apply filters
+    # Build the WHERE clause in one go; the status equality goes first so the
+    # planner can start from the per-status partial index
+    filters = []
     if status_filter and status_filter != 'All':
-        query = query.filter(Inquiry.status == status_filter)
-    
-    # Apply search
+        filters.append(Inquiry.status == status_filter)
+    # Search is one predicate over a combined document instead of five LIKE scans
     if search_value:
-        search_term = f'%{search_value}%'
-        query = query.filter(
-            (Inquiry.first_name.like(search_term)) |
-            (Inquiry.last_name.like(search_term)) |
-            (Inquiry.email.like(search_term)) |
-            (Inquiry.phone.like(search_term)) |
-            (Inquiry.status.like(search_term))
-        )
+        filters.append(_search_predicate(search_value))
+    where_clause = db.and_(*filters) if filters else None
+    if where_clause is not None:
+        stmt += lambda s: s.where(where_clause)
     
-    # Count total records
-    total_records = query.count()
+    # Count total records (approximate when browsing unfiltered, exact otherwise)
+    if where_clause is None:
+        total_records = approx_inquiry_count()
+    else:
+        count_stmt = lambda_stmt(lambda: select(db.func.count(Inquiry.id)))
+        count_stmt += lambda s: s.where(where_clause)
+        total_records = db.session.execute(count_stmt).scalar()
     
-    # Apply ordering
+    # Apply ordering (always with an id tiebreaker so keyset pagination is stable)
     if order_column_idx is not None:
         column_name = columns[order_column_idx]
-        column = getattr(Inquiry, column_name)
-        
-        if order_dir == 'desc':
-            query = query.order_by(column.desc())
-        else:
-            query = query.order_by(column.asc())
     else:
         # Default order by date received (newest first)
-        query = query.order_by(Inquiry.date_received.desc())
-    
+        column_name = 'date_received'
+        order_dir = 'desc'
+    column = getattr(Inquiry, column_name)
+    descending = order_dir == 'desc'
+
+    # Keyset pagination: when the client echoes back the cursor of the previous
+    # page, seek past it using the index instead of scanning and discarding rows.
+    # OFFSET is kept as a fallback for the first page and for random page jumps.
+    last_id = request.args.get('last_id', type=int)
+    last_sort_value = request.args.get('last_sort_value')
+    cursor = None
+    if start and last_id is not None and last_sort_value is not None:
+        try:
+            cursor = (_parse_cursor_value(column_name, last_sort_value), last_id)
+        except (TypeError, ValueError):
+            cursor = None
+
+    if cursor is not None:
+        cursor_value, cursor_id = cursor
+        if descending:
+            seek = tuple_(column, Inquiry.id) < tuple_(cursor_value, cursor_id)
+        else:
+            seek = tuple_(column, Inquiry.id) > tuple_(cursor_value, cursor_id)
+        # A row-value comparison against NULL is NULL, so rows with a NULL sort value
+        # that come after the cursor (PostgreSQL ASC, SQLite DESC) must be let through
+        # explicitly. Cursors are only issued for non-NULL values (see below), so NULLs
+        # sorting before the cursor have already been paged past.
+        nulls_after = (db.engine.dialect.name == 'postgresql') != descending
+        if nulls_after and column.property.columns[0].nullable:
+            seek = db.or_(seek, column.is_(None))
+        stmt += lambda s: s.where(seek)
+
+    if descending:
+        stmt += lambda s: s.order_by(column.desc(), Inquiry.id.desc())
+    else:
+        stmt += lambda s: s.order_by(column.asc(), Inquiry.id.asc())
+    # The raw sort value is needed for the next keyset cursor
+    stmt += lambda s: s.add_columns(column.label('sort_value'))
+
     # Apply pagination
-    inquiries = query.offset(start).limit(length).all()
-    
+    if cursor is None:
+        offset = start or 0
+        stmt += lambda s: s.offset(offset)
+    stmt += lambda s: s.limit(length)
+    rows = db.session.execute(stmt).all()
+
     # Prepare data for DataTables
+    # (the View/Edit link is rendered client-side from the id)
     data = []
-    for inquiry in inquiries:
-        # Format dates for display
-        travel_start = inquiry.travel_start if inquiry.travel_start else ''
-        travel_end = inquiry.travel_end if inquiry.travel_end else ''
-        
-        # Create full name
-        full_name = f"{inquiry.first_name} {inquiry.last_name}".strip()
-        
-        # Format date received
-        date_received = inquiry.date_received.strftime('%Y-%m-%d %H:%M')
-        
-        data.append({
-            'id': inquiry.id,
-            'date_received': date_received,
-            'client_name': full_name,
-            'email': inquiry.email,
-            'phone': inquiry.phone,
-            'travel_dates': f"{travel_start} to {travel_end}" if travel_start and travel_end else "",
-            'trip_cost': f"${inquiry.trip_cost:.2f}" if inquiry.trip_cost else "",
-            'status': inquiry.status,
-            'actions': f'<a href="/inquiry/{inquiry.id}" class="btn btn-sm btn-info">View/Edit</a>'
-        })
+    for row in rows:
+        item = dict(row._mapping)
+        del item['sort_value']
+        data.append(item)
     
+    # Cursor for the next page (only when the sort value can be compared; once the
+    # page ends inside the NULL tail, later pages fall back to OFFSET)
+    next_cursor = None
+    if rows and rows[-1].sort_value is not None:
+        next_cursor = {
+            'start': (start or 0) + len(rows),
+            'last_id': rows[-1].id,
+            'last_sort_value': _serialize_cursor_value(rows[-1].sort_value)
+        }
+
     # Prepare response
     response = {
         'draw': draw,
         'recordsTotal': total_records,
         'recordsFiltered': total_records,
-        'data': data
+        'data': data,
+        'next_cursor': next_cursor
     }
     
-    return jsonify(response)
+    # orjson encodes the page several times faster than the stdlib-backed jsonify
+    return Response(orjson.dumps(response), mimetype='application/json')
 
 @app.route('/inquiry/<int:inquiry_id>', methods=['GET'])
 @login_required
 def inquiry_detail(inquiry_id):
-    inquiry = Inquiry.query.get_or_404(inquiry_id)
+    # The detail page only renders scalar columns; fail loudly if a relationship is ever lazy-loaded
+    inquiry = db.session.execute(
+        select(Inquiry).options(raiseload('*')).where(Inquiry.id == inquiry_id)
+    ).scalar_one_or_none()
+    if inquiry is None:
+        abort(404)
     return render_template('inquiry_detail.html', inquiry=inquiry, title='Inquiry Details')
 
 @app.route('/update/<int:inquiry_id>', methods=['POST'])
@@ -250,6 +454,7 @@ def update_inquiry(inquiry_id):
     
     try:
         db.session.commit()
+        cache.delete_memoized(_status_counts)
         flash('Inquiry updated successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -261,45 +466,48 @@ def update_inquiry(inquiry_id):
 @app.route('/export')
 @login_required
 def export_csv():
-    # Get all inquiries
-    inquiries = Inquiry.query.all()
-    
-    # Create CSV in memory
-    si = StringIO()
-    writer = csv.writer(si)
-    
-    # Write header
-    writer.writerow([
-        'ID', 'Date Received', 'First Name', 'Last Name', 'Address', 'Date of Birth',
-        'Travel Start', 'Travel End', 'Trip Cost', 'Email', 'Phone', 'Status'
-    ])
-    
-    # Write data
-    for inquiry in inquiries:
+    def generate():
+        # Reuse one small buffer per row instead of building the whole file in memory
+        si = StringIO()
+        writer = csv.writer(si)
+
+        # Write header
         writer.writerow([
-            inquiry.id,
-            inquiry.date_received.strftime('%Y-%m-%d %H:%M:%S'),
-            inquiry.first_name,
-            inquiry.last_name,
-            inquiry.address,
-            inquiry.dob,
-            inquiry.travel_start,
-            inquiry.travel_end,
-            inquiry.trip_cost,
-            inquiry.email,
-            inquiry.phone,
-            inquiry.status
+            'ID', 'Date Received', 'First Name', 'Last Name', 'Address', 'Date of Birth',
+            'Travel Start', 'Travel End', 'Trip Cost', 'Email', 'Phone', 'Status'
         ])
-    
-    # Prepare response
-    output = si.getvalue()
-    si.close()
-    
-    return send_file(
-        StringIO(output),
+        yield si.getvalue()
+
+        # Stream data rows as plain tuples, fetched from the DB in batches
+        rows = db.session.query(
+            Inquiry.id, Inquiry.date_received, Inquiry.first_name, Inquiry.last_name,
+            Inquiry.address, Inquiry.dob, Inquiry.travel_start, Inquiry.travel_end,
+            Inquiry.trip_cost, Inquiry.email, Inquiry.phone, Inquiry.status
+        ).yield_per(1000)
+        for row in rows:
+            si.seek(0)
+            si.truncate(0)
+            writer.writerow([
+                row.id,
+                row.date_received.isoformat(sep=' ', timespec='seconds'),
+                row.first_name,
+                row.last_name,
+                row.address,
+                row.dob,
+                row.travel_start,
+                row.travel_end,
+                row.trip_cost,
+                row.email,
+                row.phone,
+                row.status
+            ])
+            yield si.getvalue()
+
+    filename = f'booking_inquiries_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
+    return Response(
+        stream_with_context(generate()),
         mimetype='text/csv',
-        download_name=f'booking_inquiries_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv',
-        as_attachment=True
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
     )
 
 # Error handlers
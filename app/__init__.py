@@ -1,32 +1,256 @@
 # Standard library imports
 import os
+import re
+import sys
 import logging
 import atexit
-from datetime import datetime, timezone, timedelta # Added datetime
-import json # Added json
+import importlib
+import functools
+import hashlib
+import json
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
 
 # Third-party imports
-from flask import Flask
-import click # Added click for CLI commands
-from flask.cli import with_appcontext # Added for CLI context
-import arrow # Added for datetime humanization
-from .whatsapp_routes import whatsapp_bp
+from flask import Flask, g
+from cachetools import TTLCache
+from sqlalchemy.orm import make_transient_to_detached
 
 # Import config
-from config import config_by_name # Import the config dictionary
+from config import ActiveConfig, safe_database_uri # Import the active config class
 
 # Import extensions from the new file
-from .extensions import db, login_manager, migrate, scheduler # Added scheduler
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from .extensions import db, login_manager, migrate, scheduler, compress # Added scheduler, compress
+
+logger = logging.getLogger(__name__)
+
+# --- Blueprints (imported lazily) ---
+# name -> (module, attribute, url_prefix). Blueprint modules pull in the models and
+# service helpers, so they are only imported when create_app() registers them or
+# when accessed as attributes of this package (e.g. `from app import whatsapp_bp`).
+_LAZY_BLUEPRINTS = {
+    'main_bp': ('app.routes', 'main_bp', None),
+    'auth_bp': ('app.auth', 'auth_bp', '/auth'),
+    'whatsapp_bp': ('app.whatsapp_routes', 'whatsapp_bp', None),
+}
+
+@functools.cache
+def _load_blueprint(name):
+    """Single import site for blueprints; the object is cached for later create_app() calls."""
+    module_name, attr, _ = _LAZY_BLUEPRINTS[name]
+    return getattr(importlib.import_module(module_name), attr)
+
+def __getattr__(name):
+    """Import blueprint modules on first attribute access."""
+    if name in _LAZY_BLUEPRINTS:
+        return _load_blueprint(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # --- Configure Logging ---
-# Set level to DEBUG to capture detailed filter logs
-logging.basicConfig(level=logging.INFO, # Changed to INFO for less verbosity in prod
-                    format='%(asctime)s - %(levelname)s - %(name)s - %(threadName)s - %(message)s')
+class JsonLogFormatter(logging.Formatter):
+    """Format records as single-line JSON so log shippers don't need to re-parse text."""
+    def format(self, record):
+        payload = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if os.getenv('LOG_THREADS') == '1':
+            payload['thread'] = record.threadName
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload)
+
+def configure_logging(config):
+    """Configure root logging once (repeated create_app calls, e.g. in tests, are no-ops).
+
+    LOG_FORMAT selects 'text' (default) or 'json'. In production, records are
+    handed to a QueueListener thread so request threads don't block on log I/O.
+    """
+    root_logger = logging.getLogger()
+    if not root_logger.handlers:
+        if config.get('LOG_FORMAT') == 'json':
+            formatter = JsonLogFormatter()
+        # Thread names are only useful when debugging the scheduler/worker threads
+        elif os.getenv('LOG_THREADS') == '1':
+            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(threadName)s - %(message)s')
+        else:
+            formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s')
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+
+        if config.get('ENV') == 'production':
+            log_queue = queue.SimpleQueue()
+            listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+            listener.start()
+            atexit.register(listener.stop) # Flush queued records on shutdown
+            root_logger.addHandler(QueueHandler(log_queue))
+        else:
+            root_logger.addHandler(stream_handler)
+    root_logger.setLevel(str(config.get('LOG_LEVEL', 'INFO')).upper())
+    # SQLAlchemy per-statement logging is far too chatty for the request path
+    logging.getLogger('sqlalchemy.engine').setLevel(logging.WARNING)
+
+# --- Configuration Checks ---
+# (group name, config keys, what happens when any key is missing)
+_OPTIONAL_GROUPS = [
+    ('OpenAI', ['OPENAI_API_KEY'], "OpenAI features will be disabled."),
+    ('MS Graph', ['MS_GRAPH_CLIENT_ID', 'MS_GRAPH_CLIENT_SECRET', 'MS_GRAPH_TENANT_ID', 'MS_GRAPH_MAILBOX_USER_ID'],
+     "Email polling will likely fail."),
+    ('WAAPI', ['WAAPI_API_TOKEN', 'WAAPI_INSTANCE_ID'], "WhatsApp features may be disabled or fail."),
+]
+# Production refuses to start without these (WhatsApp is optional)
+_PRODUCTION_REQUIRED_GROUPS = [
+    ('Core', ['SECRET_KEY', 'DATABASE_URL'], None),
+] + [group for group in _OPTIONAL_GROUPS if group[0] != 'WAAPI']
+
+# Background threads that hold a database session alongside request threads:
+# the APScheduler poll job and the in-process PendingTask worker
+_BACKGROUND_DB_THREADS = 2
+
+def _has_alembic_version(engine):
+    """Return True if Flask-Migrate/Alembic has stamped this database."""
+    try:
+        with engine.connect() as conn:
+            return conn.dialect.has_table(conn, 'alembic_version')
+    except Exception as e:
+        # First-ever boot or unreachable DB: fall back to the create_all path
+        logger.debug("Could not check for alembic_version table: %s", e)
+        return False
+
+def _schema_fingerprint(database_uri):
+    """Hash the target database and the table/column layout of all registered models."""
+    from . import models # Make sure every model is registered on the metadata
+    layout = sorted(
+        (table.name, tuple(column.name for column in table.columns))
+        for table in db.metadata.tables.values()
+    )
+    return hashlib.blake2s(repr((database_uri, layout)).encode()).hexdigest()
+
+def _is_non_server_cli_command():
+    """True for `flask <command>` invocations other than `flask run` (db, init-db, --help, ...)."""
+    # The Flask CLI sets FLASK_RUN_FROM_CLI before it loads the app
+    return os.environ.get('FLASK_RUN_FROM_CLI') == 'true' and 'run' not in sys.argv[1:]
+
+# --- Logged-in user cache ---
+# user_loader runs on every authenticated request (including each dashboard XHR);
+# keep recently loaded users for a short TTL instead of selecting the row every time.
+# Entries are plain tuples of column values, never ORM instances: each request builds
+# its own User from the snapshot, so nothing session-bound is shared between requests
+# or threads. The cache is per process, so a changed or deleted user is seen by other
+# workers within the TTL at the latest.
+_user_cache = TTLCache(maxsize=1024, ttl=30)
+_USER_SNAPSHOT_FIELDS = ('id', 'username', 'email', 'password_hash', 'date_created')
+_user_cache_lock = threading.Lock() # TTLCache is not thread-safe
+
+def forget_cached_user(user_id):
+    """Drop a user from the loader cache (call on logout or password/account changes)."""
+    with _user_cache_lock:
+        _user_cache.pop(int(user_id), None)
+
+# Captures the chat id's user part from whatsapp_<user>@c.us@internal.placeholder
+_WHATSAPP_PLACEHOLDER_RE = re.compile(r'^whatsapp_([^@]*)@(?:[^@]*@)?internal\.placeholder$')
+
+# --- Custom Template Filters ---
+_UTC = timezone.utc # Bound once; used by the filters and CLI commands
+
+def humanize_datetime_filter(dt, default_if_none="N/A"):
+    if dt is None:
+        return default_if_none
+    # Ensure datetime is timezone-aware (UTC if naive)
+    if dt.tzinfo is None or dt.tzinfo.utcoffset(dt) is None:
+        dt = dt.replace(tzinfo=_UTC) # Assume UTC if naive
+    # One "now" per request, shared by every row of a listing
+    # (g lives for one request/app context, so there is nothing to reset between requests)
+    now = getattr(g, '_humanize_now', None)
+    if now is None:
+        now = g._humanize_now = datetime.now(_UTC)
+    seconds = int((now - dt).total_seconds())
+    if seconds < 60: # Includes small clock skew into the future
+        return "just now"
+    if seconds < 3600:
+        minutes = seconds // 60
+        return "a minute ago" if minutes == 1 else f"{minutes} minutes ago"
+    if seconds < 86400:
+        hours = seconds // 3600
+        return "an hour ago" if hours == 1 else f"{hours} hours ago"
+    if seconds < 2592000: # 30 days
+        days = seconds // 86400
+        return "a day ago" if days == 1 else f"{days} days ago"
+    return dt.strftime("%Y-%m-%d")
+
+@functools.lru_cache(maxsize=4096) # Pure str -> str; listings repeat the same contacts
+def format_contact_filter(email_address):
+    """Format email addresses for display, especially WhatsApp ones"""
+    if not email_address:
+        return "No contact"
+
+    # Fast path for most rows: a short, ordinary email. WhatsApp placeholders are at least
+    # 30 characters (whatsapp_ + @internal.placeholder), so they can't be this short.
+    if len(email_address) <= 25:
+        return f"✉️ {email_address}"
+
+    # WhatsApp inquiries use whatsapp_<chatId>@internal.placeholder, e.g. chatId 15551234567@c.us
+    match = _WHATSAPP_PLACEHOLDER_RE.match(email_address)
+    if match:
+        phone_part = match.group(1)
+        phone_length = len(phone_part)
+        if phone_length == 11 and phone_part[0] == '1':
+            # US number with country code
+            return f"📱 WhatsApp: ({phone_part[1:4]}) {phone_part[4:7]}-{phone_part[7:]}"
+        if phone_length == 10:
+            # US number without country code
+            return f"📱 WhatsApp: ({phone_part[:3]}) {phone_part[3:6]}-{phone_part[6:]}"
+        if phone_length > 10:
+            # International number
+            return f"📱 WhatsApp: +{phone_part}"
+        return "📱 WhatsApp Contact"
+
+    # Regular email that is too long - truncate
+    return f"✉️ {email_address[:22]}..."
+
+# --- Single scheduler per host ---
+# Every Gunicorn worker (and the Postgres worker) runs create_app(); only the process
+# holding this lock starts APScheduler, so polling jobs aren't fired once per worker.
+_scheduler_lock_file = None
+
+def _acquire_scheduler_lock(app):
+    """Take the host-wide scheduler lock without blocking; True if this process holds it."""
+    global _scheduler_lock_file
+    if _scheduler_lock_file is not None:
+        return True # Already held, e.g. create_app() called again from a scheduled job
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true' and app.debug and os.environ.get('WERKZEUG_RUN_MAIN') != 'true':
+        return False # Reloader parent; the serving child process starts the scheduler
+    try:
+        import fcntl
+    except ImportError:
+        return True # No flock (Windows): single-process development server
+    lock_path = app.config.get('SCHEDULER_LOCK_FILE') or os.path.join(app.instance_path, 'scheduler.lock')
+    try:
+        os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+        lock_file = open(lock_path, 'a')
+    except OSError as e:
+        logger.warning("Could not open scheduler lock file %s (%s); starting APScheduler anyway.", lock_path, e)
+        return True
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    # Keep the file open for the life of the process; the OS drops the lock when it exits
+    _scheduler_lock_file = lock_file
+    return True
 
 # --- Application Factory Function ---
-def create_app():
-    """Create and configure an instance of the Flask application."""
+def create_app(config_class=None):
+    """Create and configure an instance of the Flask application.
+
+    `config_class` defaults to config.ActiveConfig (resolved once from FLASK_ENV);
+    tests can pass a specific class instead.
+    """
     # Explicitly set static folder relative to the 'app' directory
     app = Flask(__name__, 
                 instance_relative_config=False,
@@ -34,36 +258,38 @@ def create_app():
                 static_url_path='/static') # Default, but set explicitly
 
     # --- Configuration ---
-    # Load configuration based on FLASK_ENV environment variable
-    # Default to 'development' if FLASK_ENV is not set
-    env_name = os.getenv('FLASK_ENV', 'development')
-    try:
-        app.config.from_object(config_by_name[env_name])
-        logging.info(f"Loading configuration for environment: {env_name}")
-    except KeyError:
-        logging.warning(f"Invalid FLASK_ENV value: '{env_name}'. Falling back to default (development) configuration.")
-        app.config.from_object(config_by_name['default'])
+    # ActiveConfig is picked from FLASK_ENV once, when config.py is imported
+    app.config.from_object(config_class or ActiveConfig)
+    # Flask-SQLAlchemy recommends leaving the event system off: it instruments every
+    # attribute set and is only needed for its (unused) model signals. Query recording
+    # is a debug aid that keeps every statement in memory for the request, and echo
+    # formats and logs every statement.
+    app.config.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', False)
+    app.config.setdefault('SQLALCHEMY_RECORD_QUERIES', False)
+    app.config.setdefault('SQLALCHEMY_ECHO', False)
+    # Level comes from LOG_LEVEL (DEBUG by default in development to capture detailed filter logs)
+    # Read-only snapshot of the loaded settings; write back through app.config
+    cfg = dict(app.config)
+    configure_logging(cfg)
+    logger.info("Loaded configuration: %s", (config_class or ActiveConfig).__name__)
 
     # --- Process and Validate Configuration ---
     # Process DB URI after loading
-    db_url = app.config.get('DATABASE_URL')
+    db_url = cfg.get('DATABASE_URL')
     if db_url and db_url.startswith("postgres://"):
         app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://", 1)
     elif db_url:
         app.config['SQLALCHEMY_DATABASE_URI'] = db_url
-    elif app.config.get('ENV') != 'production': # Fallback for non-prod if DATABASE_URL missing
+    elif cfg.get('ENV') != 'production': # Fallback for non-prod if DATABASE_URL missing
         app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///dev_database.db')
-        logging.warning(f"DATABASE_URL not set. Using fallback or SQLALCHEMY_DATABASE_URI: {app.config['SQLALCHEMY_DATABASE_URI']}")
+        logger.warning("DATABASE_URL not set. Using fallback or SQLALCHEMY_DATABASE_URI: %s", app.config['SQLALCHEMY_DATABASE_URI'])
     # Production MUST have DATABASE_URL (checked below)
 
     # Add checks for required variables in production
-    if app.config.get('ENV') == 'production':
-        required_prod_vars = [
-            'SECRET_KEY', 'DATABASE_URL', 'OPENAI_API_KEY',
-            'MS_GRAPH_CLIENT_ID', 'MS_GRAPH_CLIENT_SECRET', 'MS_GRAPH_TENANT_ID', 'MS_GRAPH_MAILBOX_USER_ID',
-            # 'WAAPI_API_TOKEN', 'WAAPI_INSTANCE_ID' # Assuming WhatsApp might be optional
+    if cfg.get('ENV') == 'production':
+        missing_vars = [
+            key for _, keys, _ in _PRODUCTION_REQUIRED_GROUPS for key in keys if not cfg.get(key)
         ]
-        missing_vars = [var for var in required_prod_vars if not app.config.get(var)]
         if missing_vars:
             raise ValueError(f"Missing required production environment variables: {', '.join(missing_vars)}")
         # Also ensure the final DB URI got set
@@ -71,33 +297,55 @@ def create_app():
              raise ValueError("SQLALCHEMY_DATABASE_URI could not be determined in production.")
 
     # Add checks for development environment (warnings for optional)
-    elif app.config.get('ENV') == 'development':
+    elif cfg.get('ENV') == 'development':
         # Check for optional development dependencies/configs
         # (DB URL fallback already handled above)
-        if not app.config.get('OPENAI_API_KEY'):
-             logging.warning("OPEN_API_KEY not set. OpenAI features will be disabled.")
-        if not all([app.config.get('MS_GRAPH_CLIENT_ID'), app.config.get('MS_GRAPH_CLIENT_SECRET'), app.config.get('MS_GRAPH_TENANT_ID'), app.config.get('MS_GRAPH_MAILBOX_USER_ID')]):
-             logging.warning("One or more MS Graph environment variables (...) are not set. Email polling will likely fail.")
-        if not all([app.config.get('WAAPI_API_TOKEN'), app.config.get('WAAPI_INSTANCE_ID')]):
-             logging.warning("WAAPI_API_TOKEN or WAAPI_INSTANCE_ID not set. WhatsApp features may be disabled or fail.")
-
-    # Log final database URI being used
-    db_uri_log = app.config.get('SQLALCHEMY_DATABASE_URI', 'Not Set')
-    if 'sqlite' not in db_uri_log: # Avoid logging full credentials for remote DBs
-        try:
-            from urllib.parse import urlparse
-            parsed_uri = urlparse(db_uri_log)
-            db_uri_log = f"{parsed_uri.scheme}://{parsed_uri.hostname}:{parsed_uri.port}/{parsed_uri.path}" 
-        except Exception:
-            db_uri_log = "[Could not parse DB URI for logging]"
-    logging.info(f"Database URI set to: {db_uri_log}")
+        for name, keys, consequence in _OPTIONAL_GROUPS:
+            missing = [key for key in keys if not cfg.get(key)]
+            if missing:
+                logger.warning("%s config incomplete (missing %s): %s", name, ', '.join(missing), consequence)
+
+    # Optional for all environments: DB_POOL_SIZE (default: WEB_THREADS plus the background
+    # threads, at least 10), DB_MAX_OVERFLOW (default 20) and DB_POOL_TIMEOUT (seconds,
+    # default 30) size the SQLAlchemy connection pool below;
+    # DB_POOL_PRE_PING=true adds a liveness check on each connection checkout (off by default;
+    # PostgreSQL connections use TCP keepalives and pool_recycle instead)
+
+    # Log final database URI being used (credentials stripped once, reusable by other log lines)
+    app.config['SQLALCHEMY_DATABASE_URI_SAFE'] = safe_database_uri(app.config.get('SQLALCHEMY_DATABASE_URI'))
+    logger.info("Database URI set to: %s", app.config['SQLALCHEMY_DATABASE_URI_SAFE'])
 
     # Add SQLAlchemy engine options for connection pooling
-    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-        'pool_pre_ping': True,
-        'pool_recycle': 290,  # Recycle connections slightly before a potential 5-min timeout
-    }
-    logging.info(f"SQLAlchemy engine options configured with pool_pre_ping=True, pool_recycle=290.")
+    # Values set in the config class win; fill in the rest
+    engine_options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    engine_options.setdefault('pool_pre_ping', bool(cfg.get('DB_POOL_PRE_PING', False)))
+    engine_options.setdefault('pool_recycle', 290)  # Recycle connections slightly before a potential 5-min timeout
+    db_uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if not db_uri.startswith('sqlite'):
+        # Keep a pooled connection for every thread that can hold a session at once: the
+        # server's request threads plus the scheduler's poll job and the task worker, so
+        # neither side waits on pool_timeout under load
+        # (SQLite uses a single-connection pool that rejects these options)
+        concurrent_db_threads = int(os.getenv('WEB_THREADS', 8)) + _BACKGROUND_DB_THREADS
+        engine_options.setdefault('pool_size', int(os.getenv('DB_POOL_SIZE', max(10, concurrent_db_threads))))
+        engine_options.setdefault('max_overflow', int(os.getenv('DB_MAX_OVERFLOW', 20)))
+        engine_options.setdefault('pool_timeout', int(os.getenv('DB_POOL_TIMEOUT', 30)))
+        if engine_options['pool_size'] + engine_options['max_overflow'] < concurrent_db_threads:
+            logger.warning("Connection pool (pool_size=%s, max_overflow=%s) is smaller than the %s threads "
+                           "that may use the database; requests will queue for connections.",
+                           engine_options['pool_size'], engine_options['max_overflow'], concurrent_db_threads)
+    if db_uri.startswith('postgresql'):
+        engine_options.setdefault('connect_args', {
+            # Abort runaway queries server-side instead of holding a pooled connection
+            'options': '-c statement_timeout=30000',
+            # libpq TCP keepalives detect dead connections without a per-checkout ping
+            'keepalives': 1,
+            'keepalives_idle': 60,
+            'keepalives_interval': 10,
+            'keepalives_count': 5,
+        })
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+    logger.info("SQLAlchemy engine options configured: %s", {k: v for k, v in engine_options.items() if k != 'connect_args'})
 
     # --- Initialize Extensions with App ---
     db.init_app(app)
@@ -105,174 +353,181 @@ def create_app():
     # Setup login view after initializing
     login_manager.login_view = 'auth.login' 
     migrate.init_app(app, db) 
+    compress.init_app(app)
 
-    # --- Application Context ---
-    with app.app_context():
-        # --- Import Blueprints ---
-        from . import routes  # Import main application routes
-        from .auth import auth_bp # Import authentication blueprint
-        from .whatsapp_routes import whatsapp_bp
-        # Import other blueprints as needed
-
-        # --- Register Blueprints ---
-        app.register_blueprint(routes.main_bp)
-        app.register_blueprint(auth_bp, url_prefix='/auth')
-        app.register_blueprint(whatsapp_bp)
-        # Register other blueprints
-
-        # --- Initialize Database ---
-        logging.info("Initializing database tables within app context...")
-        try:
-            # Check if DB URI is actually set before trying create_all
-            if app.config.get('SQLALCHEMY_DATABASE_URI'):
-                db.create_all()
-                logging.info("Database tables checked/created.")
-            else:
-                logging.warning("Skipping db.create_all() because SQLALCHEMY_DATABASE_URI is not configured.")
-        except Exception as e:
-            logging.error(f"Error during database initialization: {e}", exc_info=True)
-
-        # --- Import Models (ensure they are known to SQLAlchemy before create_all) ---
-        # Typically models are imported in the modules where they are used (e.g., routes, auth)
-        # If models are defined separately, ensure they are imported somewhere before db.create_all() is called.
-        from . import models # Make sure models are imported so CLI command knows them
-
-        # --- Configure Login Manager ---
-        from .models import User # Import User model for user_loader
-        @login_manager.user_loader
-        def load_user(user_id):
-            # Return user object from the user ID stored in the session
-            return User.query.get(int(user_id))
-
-        # --- Custom Template Filters ---
-        def humanize_datetime_filter(dt, default_if_none="N/A"):
-            if dt is None:
-                return default_if_none
+    # --- Import and Register Blueprints ---
+    # Add other blueprints to _LAZY_BLUEPRINTS
+    for name, (_module_name, _attr, url_prefix) in _LAZY_BLUEPRINTS.items():
+        if url_prefix:
+            app.register_blueprint(_load_blueprint(name), url_prefix=url_prefix)
+        else:
+            app.register_blueprint(_load_blueprint(name))
+
+    # --- Initialize Database ---
+    # Schema is managed by `flask db upgrade` (or `flask init-db`); only auto-create
+    # tables on startup when AUTO_CREATE_ALL is enabled (development default)
+    # (create_all and the engine need an app context; nothing else below does)
+    if app.config.get('AUTO_CREATE_ALL') and app.config.get('ENV') == 'production':
+        # Migrations own the production schema; don't probe every table on each worker boot
+        logger.info("Skipping db.create_all() in production; run 'flask db upgrade' to apply schema changes.")
+    elif app.config.get('AUTO_CREATE_ALL'):
+        with app.app_context():
+            logger.info("Initializing database tables within app context...")
             try:
-                # Ensure datetime is timezone-aware (UTC if naive)
-                if dt.tzinfo is None or dt.tzinfo.utcoffset(dt) is None:
-                    dt = dt.replace(tzinfo=timezone.utc) # Assume UTC if naive
-                return arrow.get(dt).humanize()
-            except Exception as e:
-                logging.warning(f"Error humanizing datetime '{dt}': {e}")
-                # Fallback to string representation or a placeholder
-                return dt.strftime("%Y-%m-%d %H:%M") if isinstance(dt, datetime) else default_if_none
-
-        app.jinja_env.filters['humanize_datetime'] = humanize_datetime_filter
-        logging.info("Registered custom Jinja filter: humanize_datetime")
-        
-        def format_contact_filter(email_address):
-            """Format email addresses for display, especially WhatsApp ones"""
-            if not email_address:
-                return "No contact"
-            
-            # Check if it's a WhatsApp email
-            if '@internal.placeholder' in email_address and 'whatsapp_' in email_address:
-                # Extract the phone number from whatsapp_PHONENUMBER@c.us@internal.placeholder
-                try:
-                    # Extract phone number between 'whatsapp_' and '@c.us'
-                    phone_part = email_address.replace('whatsapp_', '').split('@')[0]
-                    if len(phone_part) >= 10:  # Valid phone number length
-                        # Format as (XXX) XXX-XXXX for US numbers or +XX XXX XXX XXXX for international
-                        if len(phone_part) == 11 and phone_part.startswith('1'):
-                            # US number with country code
-                            formatted = f"({phone_part[1:4]}) {phone_part[4:7]}-{phone_part[7:]}"
-                            return f"📱 WhatsApp: {formatted}"
-                        elif len(phone_part) == 10:
-                            # US number without country code
-                            formatted = f"({phone_part[:3]}) {phone_part[3:6]}-{phone_part[6:]}"
-                            return f"📱 WhatsApp: {formatted}"
-                        else:
-                            # International number
-                            return f"📱 WhatsApp: +{phone_part}"
+                # Check if DB URI is actually set before trying create_all
+                if app.config.get('SQLALCHEMY_DATABASE_URI') and _has_alembic_version(db.engine):
+                    # Alembic owns the schema once a revision is stamped
+                    logger.info("Database is managed by Alembic (alembic_version present); skipping db.create_all().")
+                elif app.config.get('SQLALCHEMY_DATABASE_URI'):
+                    # Skip the per-table existence probes when the schema hasn't changed since the last boot
+                    fingerprint_path = os.path.join(app.instance_path, '.schema_fingerprint')
+                    fingerprint = _schema_fingerprint(app.config['SQLALCHEMY_DATABASE_URI'])
+                    try:
+                        with open(fingerprint_path) as f:
+                            schema_unchanged = f.read().strip() == fingerprint
+                    except OSError:
+                        schema_unchanged = False
+                    if schema_unchanged:
+                        logger.info("Database schema fingerprint unchanged; skipping db.create_all().")
                     else:
-                        return "📱 WhatsApp Contact"
-                except Exception:
-                    return "📱 WhatsApp Contact"
-            
-            # Regular email - truncate if too long
-            if len(email_address) > 25:
-                return f"✉️ {email_address[:22]}..."
-            else:
-                return f"✉️ {email_address}"
-
-        app.jinja_env.filters['format_contact'] = format_contact_filter
-        logging.info("Registered custom Jinja filter: format_contact")
-
-        # --- Custom CLI Commands ---
-        register_cli_commands(app)
-
-        # --- Configure and Start APScheduler ---
-        ms_graph_config_ok = all([
-            app.config.get('MS_GRAPH_CLIENT_ID'),
-            app.config.get('MS_GRAPH_CLIENT_SECRET'),
-            app.config.get('MS_GRAPH_TENANT_ID'),
-            app.config.get('MS_GRAPH_MAILBOX_USER_ID')
-        ])
-        openai_config_ok = bool(app.config.get('OPENAI_API_KEY'))
-        db_uri_ok = bool(app.config.get('SQLALCHEMY_DATABASE_URI'))
-
-        if ms_graph_config_ok and openai_config_ok and db_uri_ok:
-            logging.info("Required configurations for background tasks and DB are present.")
-            try:
-                from ms_graph_service import configure_ms_graph_client
-                from data_extraction_service import configure_openai_client
-                from .background_tasks import trigger_email_polling_task_creation
+                        db.create_all()
+                        logger.info("Database tables checked/created.")
+                        try:
+                            os.makedirs(app.instance_path, exist_ok=True)
+                            with open(fingerprint_path, 'w') as f:
+                                f.write(fingerprint)
+                        except OSError as e:
+                            logger.warning("Could not write schema fingerprint to %s: %s", fingerprint_path, e)
+                else:
+                    logger.warning("Skipping db.create_all() because SQLALCHEMY_DATABASE_URI is not configured.")
+            except Exception as e:
+                logger.error("Error during database initialization: %s", e, exc_info=True)
+
+    # Models are imported by the blueprint modules that use them (routes, auth), which
+    # registers them on the metadata before create_all and `flask db migrate` need them.
+
+    # --- Configure Login Manager ---
+    @login_manager.user_loader
+    def load_user(user_id):
+        # Malformed session value (e.g. tampered cookie); treat as anonymous without raising
+        if not isinstance(user_id, str) or not user_id.isdigit():
+            return None
+        uid = int(user_id)
+        from .models import User # Resolved on first call, not at app creation
+        with _user_cache_lock:
+            snapshot = _user_cache.get(uid)
+        if snapshot is not None:
+            # Rebuild a fresh User for this request and attach it without re-querying the row
+            user = User(**dict(zip(_USER_SNAPSHOT_FIELDS, snapshot)))
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+        # Return user object from the user ID stored in the session
+        # (Session.get checks the identity map before querying; the key must be an int to match it)
+        user = db.session.get(User, uid)
+        if user is not None:
+            with _user_cache_lock:
+                _user_cache[uid] = tuple(getattr(user, field) for field in _USER_SNAPSHOT_FIELDS)
+        return user
+
+    # --- Custom Template Filters ---
+    app.jinja_env.filters['humanize_datetime'] = humanize_datetime_filter
+    app.jinja_env.filters['format_contact'] = format_contact_filter
+    logger.info("Registered custom Jinja filters: humanize_datetime, format_contact")
+
+    # --- Custom CLI Commands ---
+    register_cli_commands(app)
+
+    # --- Configure and Start APScheduler ---
+    ms_graph_config_ok = bool(
+        cfg.get('MS_GRAPH_CLIENT_ID')
+        and cfg.get('MS_GRAPH_CLIENT_SECRET')
+        and cfg.get('MS_GRAPH_TENANT_ID')
+        and cfg.get('MS_GRAPH_MAILBOX_USER_ID')
+    )
+    openai_config_ok = bool(cfg.get('OPENAI_API_KEY'))
+    db_uri_ok = bool(app.config.get('SQLALCHEMY_DATABASE_URI'))
+
+    if _is_non_server_cli_command():
+        # CLI commands don't poll email: skip importing msal/OpenAI and starting the scheduler
+        logger.debug("Flask CLI command detected; APScheduler and API clients are not started.")
+    elif ms_graph_config_ok and openai_config_ok and db_uri_ok:
+        logger.info("Required configurations for background tasks and DB are present.")
+        try:
+            from ms_graph_service import configure_ms_graph_client
+            from data_extraction_service import configure_openai_client
+            from .background_tasks import trigger_email_polling_task_creation
 
-                configure_ms_graph_client(app.config)
-                configure_openai_client(app.config)
-                logging.info("MS Graph and OpenAI clients configured.")
+            configure_ms_graph_client(app.config)
+            configure_openai_client(app.config)
+            logger.info("MS Graph and OpenAI clients configured.")
 
-                # Configure APScheduler
-                jobstore_url = app.config['SQLALCHEMY_DATABASE_URI']
+            # Configure APScheduler
+            jobstore_url = app.config['SQLALCHEMY_DATABASE_URI']
+            jobstore_successfully_configured = False
+            try:
+                # Check if jobstore named 'default' already exists to avoid ValueError
+                # Use state property instead of get_jobstores() for newer APScheduler versions
+                existing_jobstores = getattr(scheduler, '_jobstores', {})
+                if 'default' not in existing_jobstores:
+                    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore # Only needed when the scheduler runs
+                    scheduler.add_jobstore(SQLAlchemyJobStore(url=jobstore_url), alias='default')
+                    logger.info("APScheduler 'default' job store added/configured.")
+                else:
+                    logger.info("APScheduler 'default' job store was already configured.")
+                jobstore_successfully_configured = True
+            except Exception as e:
+                # Catch any other exceptions during job store configuration
+                logger.error("Error configuring/checking APScheduler job store 'default': %s", e, exc_info=True)
                 jobstore_successfully_configured = False
-                try:
-                    # Check if jobstore named 'default' already exists to avoid ValueError
-                    # Use state property instead of get_jobstores() for newer APScheduler versions
-                    existing_jobstores = getattr(scheduler, '_jobstores', {})
-                    if 'default' not in existing_jobstores:
-                        scheduler.add_jobstore(SQLAlchemyJobStore(url=jobstore_url), alias='default')
-                        logging.info("APScheduler 'default' job store added/configured.")
-                    else:
-                        logging.info("APScheduler 'default' job store was already configured.")
-                    jobstore_successfully_configured = True
-                except Exception as e:
-                    # Catch any other exceptions during job store configuration
-                    logging.error(f"Error configuring/checking APScheduler job store 'default': {e}", exc_info=True)
-                    jobstore_successfully_configured = False
-
-                if jobstore_successfully_configured:
-                    # Check if scheduler is already running to prevent errors on re-creation
-                    if not scheduler.running:
-                        try:
-                            scheduler.start(paused=False)
-                            logging.info("APScheduler started successfully.")
-                            # Ensure the scheduler shuts down when the app exits
-                            atexit.register(lambda: scheduler.shutdown())
-                        except Exception as e:
-                            logging.error(f"Failed to start APScheduler: {e}", exc_info=True)
-                    else:
-                        logging.info("APScheduler was already running.")
 
-            except ImportError as import_err:
-                 logging.error(f"Could not import necessary service or task modules for scheduler: {import_err}")
-            except Exception as startup_err:
-                logging.error(f"Error during APScheduler startup or job scheduling: {startup_err}", exc_info=True)
-        else:
-            missing_configs_for_scheduler = []
-            if not ms_graph_config_ok: missing_configs_for_scheduler.append("MS Graph")
-            if not openai_config_ok: missing_configs_for_scheduler.append("OpenAI")
-            if not db_uri_ok: missing_configs_for_scheduler.append("Database URI")
-            logging.warning(f"APScheduler WILL NOT be started due to missing configuration for: {', '.join(missing_configs_for_scheduler)}")
-
-        # --- Return App Instance ---
-        logging.info("Flask app created successfully.")
-        return app
+            if jobstore_successfully_configured:
+                # Check if scheduler is already running to prevent errors on re-creation
+                if not scheduler.running and not _acquire_scheduler_lock(app):
+                    logger.info("APScheduler is running in another process; not starting it here.")
+                elif not scheduler.running:
+                    try:
+                        # Queue an email poll every POLL_INTERVAL_SECONDS (ticks are skipped while the
+                        # poller is backing off); replace_existing updates the persisted job's interval
+                        poll_interval = app.config.get('POLL_INTERVAL_SECONDS', 300)
+                        scheduler.add_job(
+                            trigger_email_polling_task_creation, 'interval',
+                            seconds=poll_interval, id='email_poll', replace_existing=True,
+                            next_run_time=datetime.now(timezone.utc)
+                        )
+                        scheduler.start(paused=False)
+                        logger.info("APScheduler started successfully (email poll every %ss).", poll_interval)
+                        # Ensure the scheduler shuts down when the app exits, letting a running job finish
+                        atexit.register(scheduler.shutdown, wait=True)
+                    except Exception as e:
+                        logger.error("Failed to start APScheduler: %s", e, exc_info=True)
+                else:
+                    logger.info("APScheduler was already running.")
+
+        except ImportError as import_err:
+             logger.error("Could not import necessary service or task modules for scheduler: %s", import_err)
+        except Exception as startup_err:
+            logger.error("Error during APScheduler startup or job scheduling: %s", startup_err, exc_info=True)
+    else:
+        missing_configs_for_scheduler = []
+        if not ms_graph_config_ok: missing_configs_for_scheduler.append("MS Graph")
+        if not openai_config_ok: missing_configs_for_scheduler.append("OpenAI")
+        if not db_uri_ok: missing_configs_for_scheduler.append("Database URI")
+        logger.warning("APScheduler WILL NOT be started due to missing configuration for: %s", ', '.join(missing_configs_for_scheduler))
+
+    # --- Return App Instance ---
+    logger.info("Flask app created successfully.")
+    return app
 
 # --- CLI Command Definitions ---
 def register_cli_commands(app):
     """Register custom CLI commands for the application."""
-    
+    # CLI-only dependencies, imported when the commands are registered rather than
+    # as part of the package's module-level imports
+    from datetime import timedelta
+    import click
+    from flask.cli import with_appcontext
+    from sqlalchemy import update
+
     @app.cli.command('fix-tasks')
     @with_appcontext
     def fix_stuck_whatsapp_tasks_command():
@@ -283,33 +538,34 @@ def register_cli_commands(app):
         
         old_task_type = 'process_whatsapp_message'
         new_task_type = 'new_whatsapp_message'
-        time_threshold = datetime.now(timezone.utc) - timedelta(seconds=10)
+        time_threshold = datetime.now(_UTC) - timedelta(seconds=10)
 
         try:
-            total_pending = db.session.query(PendingTask).filter_by(status='pending').count()
-            click.echo(f"Successfully connected to DB. Found {total_pending} total pending task(s).")
-            
-            tasks_to_fix = db.session.query(PendingTask).filter(
+            # One UPDATE ... RETURNING round trip finds, fixes and reports the tasks
+            # (PostgreSQL, SQLite 3.35+); no rows are loaded into the session
+            stmt = update(PendingTask).where(
                 PendingTask.task_type == old_task_type,
                 PendingTask.status == 'pending',
                 PendingTask.created_at <= time_threshold
-            ).all()
+            ).values(task_type=new_task_type).execution_options(synchronize_session=False)
+            if db.engine.dialect.update_returning:
+                updated_ids = db.session.scalars(stmt.returning(PendingTask.id)).all()
+                updated_count = len(updated_ids)
+            else:
+                updated_ids = None
+                updated_count = db.session.execute(stmt).rowcount
 
-            if not tasks_to_fix:
+            if not updated_count:
+                db.session.rollback()
                 click.echo(f"Query executed. No stuck tasks found with type '{old_task_type}'.")
                 click.echo("--- Script Finished ---")
                 return
 
-            click.echo(f"Found {len(tasks_to_fix)} stuck WhatsApp task(s). Updating them now...")
-
-            updated_count = 0
-            for task in tasks_to_fix:
-                task.task_type = new_task_type
-                updated_count += 1
-            
             db.session.commit()
 
             click.echo(f"Successfully updated {updated_count} task(s) to type '{new_task_type}'.")
+            if updated_ids:
+                click.echo(f"Updated task IDs: {', '.join(map(str, updated_ids))}")
             click.echo("The background worker should now be able to process these tasks.")
 
         except Exception as e:
@@ -320,6 +576,14 @@ def register_cli_commands(app):
         click.echo("--- Script Finished ---")
 
 
+    @app.cli.command('init-db')
+    @with_appcontext
+    def init_db_command():
+        """Creates any missing database tables (production should use 'flask db upgrade')."""
+        from . import models # Make sure all models are registered on the metadata
+        db.create_all()
+        click.echo("Database tables checked/created.")
+
     @app.cli.command('seed-sample')
     @with_appcontext
     def seed_sample_inquiry():
@@ -341,61 +605,66 @@ def register_cli_commands(app):
 
         click.echo("Starting sample data seeding...")
         try:
-            # Check if inquiry already exists
-            existing_inquiry = Inquiry.query.filter_by(primary_email_address=sample_email_address).first()
-            if existing_inquiry:
-                click.echo(f"Inquiry for {sample_email_address} already exists (ID: {existing_inquiry.id}). Skipping.")
+            # Check if inquiry already exists (only the id is needed, so don't load the row)
+            existing_inquiry_id = db.session.query(Inquiry.id).filter_by(primary_email_address=sample_email_address).limit(1).scalar()
+            if existing_inquiry_id is not None:
+                click.echo(f"Inquiry for {sample_email_address} already exists (ID: {existing_inquiry_id}). Skipping.")
                 return
 
-            # 1. Create Inquiry
+            # Check if the sample email already exists (identity-map aware lookup)
+            existing_email = db.session.get(Email, sample_graph_id)
+
+            # 1. Create Inquiry (its id is assigned at flush; the rows below link via relationships)
             click.echo(f"Creating Inquiry for {sample_email_address}...")
             inquiry = Inquiry(
                 primary_email_address=sample_email_address,
                 status="Complete" # Assume data is complete for demo
             )
-            db.session.add(inquiry)
-            db.session.flush() # Flush to get the inquiry.id assigned by the DB
-            click.echo(f"Inquiry created with ID: {inquiry.id}")
+            new_objects = [inquiry]
 
             # 2. Create ExtractedData linked to Inquiry
             click.echo("Creating ExtractedData...")
             extracted_data = ExtractedData(
-                inquiry_id=inquiry.id,
+                inquiry=inquiry,
                 data=sample_data,
                 extraction_source="manual_sample",
                 validation_status="Complete", # Matches Inquiry status
                 missing_fields=None
             )
-            db.session.add(extracted_data)
-            click.echo(f"ExtractedData prepared (linked to Inquiry {inquiry.id})")
+            new_objects.append(extracted_data)
 
             # 3. Create a sample Email linked to Inquiry
             click.echo("Creating sample Email...")
-            # Check if email already exists first
-            existing_email = Email.query.get(sample_graph_id)
             if existing_email:
-                click.echo(f"Sample email {sample_graph_id} already exists. Linking to inquiry {inquiry.id} if not already linked.")
+                click.echo(f"Sample email {sample_graph_id} already exists. Linking to the new inquiry if not already linked.")
                 if not existing_email.inquiry_id:
-                    existing_email.inquiry_id = inquiry.id
+                    existing_email.inquiry = inquiry
             else:
                 email = Email(
                     graph_id=sample_graph_id,
                     subject="Sample Quote Request for Demo",
                     sender_address=sample_email_address, # Match inquiry
                     sender_name="Test Customer",
-                    received_at=datetime.now(timezone.utc) - timedelta(hours=2), # Sample time
-                    inquiry_id=inquiry.id, # Link to the inquiry
+                    received_at=datetime.now(_UTC) - timedelta(hours=2), # Sample time
+                    inquiry=inquiry, # Link to the inquiry
                     processing_status='processed' # Mark as processed
                 )
-                db.session.add(email)
-                click.echo(f"Email created with Graph ID: {email.graph_id} (linked to Inquiry {inquiry.id})")
+                new_objects.append(email)
+
+            db.session.add_all(new_objects)
 
             # 4. Commit the session
             click.echo("Committing transaction...")
             db.session.commit()
-            click.secho("Successfully created and committed sample data.", fg='green')
+            click.secho(f"Successfully created and committed sample data (Inquiry ID: {inquiry.id}).", fg='green')
 
         except Exception as e:
             click.secho(f"An error occurred: {e}", fg='red')
             click.echo("Rolling back transaction...")
-            db.session.rollback() 
\ No newline at end of file
+            db.session.rollback() 
+
+# Set BOOKING_EAGER_IMPORT=1 to import every blueprint module up front, once the
+# package is fully defined (deterministic CI/import checks)
+if os.getenv('BOOKING_EAGER_IMPORT'):
+    for _name in _LAZY_BLUEPRINTS:
+        _load_blueprint(_name)
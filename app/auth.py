@@ -1,15 +1,22 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import check_password_hash # For checking passwords
+import functools
+from werkzeug.security import check_password_hash, generate_password_hash # For checking passwords
+from sqlalchemy import select
 
 # Import User model and db object
 from .models import User
-from . import db
+from . import db, forget_cached_user
 
 auth_bp = Blueprint('auth', __name__,
                     template_folder='templates',
                     static_folder='static')
 
+@functools.cache
+def _dummy_password_hash():
+    """Hash compared against when the username is unknown; generated once, on first use."""
+    return generate_password_hash('dummy-password-for-timing')
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     """Handle user login."""
@@ -25,10 +32,13 @@ def login():
 
         # --- Actual Login Logic --- 
         # Find user by username
-        user = User.query.filter_by(username=username).first()
+        # (username is UNIQUE, so this is an indexed lookup returning at most one row)
+        user = db.session.execute(select(User).where(User.username == username)).scalar_one_or_none()
 
-        # Check if user exists and password hash matches
-        if not user or not check_password_hash(user.password_hash, password):
+        # Check if user exists and password hash matches. Always run the hash check (against a
+        # dummy hash for unknown users) so response time doesn't reveal whether a username exists.
+        password_ok = check_password_hash(user.password_hash if user else _dummy_password_hash(), password or '')
+        if not user or not password_ok:
             flash('Please check your login details and try again.')
             return redirect(url_for('auth.login'))
         
@@ -46,6 +56,7 @@ def login():
 @login_required
 def logout():
     """Handle user logout."""
+    forget_cached_user(current_user.get_id())
     logout_user()
     return redirect(url_for('auth.login'))
 
@@ -1,24 +1,37 @@
+import functools
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy import and_, insert, or_, select
+from sqlalchemy.orm import joinedload
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.sql import func
-from flask import current_app
+from flask import current_app, has_app_context
 
 # Removed RQ Imports:
 # from redis import Redis
 # from rq import Queue
 # import redis
 
-# Import necessary components from the main app package and services
-# We assume db and models are accessible via the app context later
-# We need the service functions directly
+# Import necessary components from the main app package and services.
+# db and the models are imported once at module level (the app package is fully
+# initialised before this module is loaded); queries still need an app context.
 from ms_graph_service import (
     fetch_email_details as ms_fetch_email_details,
     fetch_attachments_list as ms_fetch_attachments_list,
-    fetch_new_emails_since as ms_fetch_new_emails_since
+    fetch_email_delta as ms_fetch_email_delta,
+    fetch_details_and_attachments_batch as ms_fetch_details_and_attachments_batch,
+    PROCESSING_DETAIL_FIELDS
 )
 from data_extraction_service import extract_travel_data, classify_email_intent
+from .extensions import db
+from .models import Inquiry, Email, ExtractedData, AttachmentMetadata, PendingTask, PollerState, WhatsAppMessage
+
+logger = logging.getLogger(__name__)
 
 # --- Removed RQ Setup ---
 # redis_conn = None
@@ -26,9 +39,89 @@ from data_extraction_service import extract_travel_data, classify_email_intent
 # def get_redis_conn(): ...
 # def get_email_queue(): ...
 
-# --- Global variable for polling timestamp ---
-# This might be better managed via a database table/setting in a more robust system
-last_checked_timestamp = None
+# PollerState key holding the Graph delta link for the inbox between poll cycles
+INBOX_DELTA_LINK_KEY = 'inbox_delta_link'
+# PollerState keys for the adaptive poll interval: how many polls in a row found nothing,
+# and until when the scheduled trigger should skip queuing another poll
+EMPTY_POLLS_KEY = 'consecutive_empty_polls'
+POLL_BACKOFF_UNTIL_KEY = 'poll_backoff_until'
+# Default cap for the backoff (overridable via the POLL_MAX_INTERVAL_SECONDS config setting)
+MAX_POLL_INTERVAL_SECONDS = 600
+# After this long a 'processing' poll task is presumed orphaned by a killed worker and no
+# longer blocks the scheduled trigger (overridable via POLL_TASK_STALE_SECONDS)
+POLL_TASK_STALE_SECONDS = 900
+
+def _next_poll_interval(base_interval, empty_polls, max_interval=MAX_POLL_INTERVAL_SECONDS):
+    """Seconds until the next poll: double after each empty poll, capped at max_interval (never below the base)."""
+    # The exponent is clamped so a long quiet spell doesn't build huge ints
+    return max(base_interval, min(max_interval, base_interval * 2 ** min(empty_polls, 32)))
+
+# Fields an inquiry needs before its extracted data counts as "Complete"
+# (overridable via the ESSENTIAL_EXTRACTION_FIELDS config setting)
+DEFAULT_ESSENTIAL_FIELDS = ("first_name", "last_name", "travel_start_date", "travel_end_date", "trip_cost")
+
+def _validate_extracted_data(data, essential_fields):
+    """Return (validation_status, missing_fields) for extracted data.
+
+    missing_fields is the comma-separated text stored on ExtractedData, or None when complete.
+    """
+    missing = tuple(field for field in essential_fields if not data.get(field))
+    return ("Incomplete" if missing else "Complete"), (",".join(missing) if missing else None)
+
+@contextmanager
+def _app_context(app):
+    """Run a handler inside `app`'s context, reusing the active one instead of pushing another.
+
+    The worker already runs every task inside the app's context, so pushing a new one per
+    task (or per poll) only adds push/pop and a fresh session scope each time. When the
+    context is reused, the session belongs to whoever pushed it (the worker loop removes
+    it after each task), so it is left open here.
+    """
+    if has_app_context() and current_app._get_current_object() is app:
+        yield
+    else:
+        with app.app_context():
+            yield
+
+def _parse_graph_datetime(value):
+    """Parse a Graph timestamp such as '2024-05-01T09:30:00Z' into an aware datetime (None if empty)."""
+    if not value:
+        return None
+    # fromisoformat only accepts a trailing 'Z' from Python 3.11
+    if value[-1] == 'Z':
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
+
+# Dialects with INSERT ... ON CONFLICT; other backends fall back to plain INSERTs below
+_ON_CONFLICT_INSERTS = {'postgresql': pg_insert, 'sqlite': sqlite_insert}
+
+def _insert_ignoring_duplicates(session, model, rows):
+    """INSERT `rows` for `model`, skipping rows whose primary key already exists."""
+    on_conflict_insert = _ON_CONFLICT_INSERTS.get(session.get_bind().dialect.name)
+    if on_conflict_insert is not None:
+        session.execute(on_conflict_insert(model).on_conflict_do_nothing(), rows)
+        return
+    # No ON CONFLICT: drop already-stored keys with one IN query (a concurrent insert still
+    # raises IntegrityError, which callers already handle)
+    pk = model.__mapper__.primary_key[0]
+    rows_by_key = {row[pk.key]: row for row in rows}
+    existing_keys = set(session.scalars(select(pk).where(pk.in_(list(rows_by_key)))))
+    new_rows = [row for key, row in rows_by_key.items() if key not in existing_keys]
+    if new_rows:
+        session.execute(insert(model), new_rows)
+
+def _upsert_poller_state(session, poller_state_model, values):
+    """Write every key/value in `values`: one INSERT ... ON CONFLICT (key) DO UPDATE where supported."""
+    on_conflict_insert = _ON_CONFLICT_INSERTS.get(session.get_bind().dialect.name)
+    if on_conflict_insert is None:
+        for key, value in values.items():
+            session.merge(poller_state_model(key=key, value=value))
+        return
+    stmt = on_conflict_insert(poller_state_model).values([{"key": key, "value": value} for key, value in values.items()])
+    session.execute(stmt.on_conflict_do_update(
+        index_elements=[poller_state_model.key],
+        set_={"value": stmt.excluded.value, "updated_at": func.now()}
+    ))
 
 def handle_process_single_email(task_payload):
     """
@@ -43,26 +136,33 @@ def handle_process_single_email(task_payload):
     processing_start_time = datetime.now(timezone.utc)
     
     app = current_app._get_current_object() # Ensure we have the app object for context
-    with app.app_context():
-        from . import db # Get db from the app context
-        from .models import Inquiry, Email, ExtractedData, AttachmentMetadata # Import models
-
+    with _app_context(app):
         email_summary = task_payload.get('email_summary')
         classified_intent = task_payload.get('classified_intent')
 
         if not email_summary or not classified_intent:
-            logging.error(f"[TaskHandler] Invalid payload for handle_process_single_email: {task_payload}")
+            logger.error(f"[TaskHandler] Invalid payload for handle_process_single_email: {task_payload}")
             raise ValueError("Payload missing email_summary or classified_intent")
 
         email_graph_id = email_summary.get('id')
         if not email_graph_id:
-            logging.warning(f"[TaskHandler] Email summary missing ID in task payload for email processing. Skipping.")
+            logger.warning(f"[TaskHandler] Email summary missing ID in task payload for email processing. Skipping.")
             # This specific email processing fails, but the task itself ran.
             # The worker should mark the task as failed with this reason.
             raise ValueError("Email summary missing ID")
 
         log_prefix = f"[TaskHandler Email: {email_graph_id}]"
-        logging.info(f"{log_prefix} Starting processing...")
+        logger.info(f"{log_prefix} Starting processing...")
+
+        # Check for an existing record before any Graph/OpenAI work. Only the status column is
+        # loaded (not the stored body); a concurrent insert is still caught by the IntegrityError below.
+        existing_status = db.session.scalar(select(Email.processing_status).where(Email.graph_id == email_graph_id))
+        if existing_status is not None:
+            logger.info(f"{log_prefix} Email already exists in DB (Status: {existing_status}). Assuming already processed or being processed.")
+            # Consider what to do here. If status is 'failed', maybe allow reprocessing?
+            # For now, if it exists, we skip to avoid IntegrityError.
+            # The worker should mark the task successful as this specific instance is handled.
+            return {"status": "skipped", "message": "Email already processed or processing"}
 
         # Performance: Track API call timing
         api_start_time = datetime.now(timezone.utc)
@@ -72,14 +172,18 @@ def handle_process_single_email(task_payload):
         extracted_data_dict = {}
         source = None
         validation_status = "Incomplete"
-        missing_fields_list = []
+        missing_fields = None
         attachments_list = []
         sender_address = None
         sender_name = None
 
         try:
-            logging.info(f"{log_prefix} Fetching full details...")
-            email_details = ms_fetch_email_details(email_graph_id)
+            # The poller prefetches details/attachments in $batch requests; fall back to
+            # single-email calls when they are missing (batch sub-request failed, old tasks)
+            email_details = task_payload.get('email_details')
+            if not email_details:
+                logger.debug("%s Fetching full details...", log_prefix)
+                email_details = ms_fetch_email_details(email_graph_id, fields=PROCESSING_DETAIL_FIELDS)
             if not email_details:
                 raise Exception(f"Failed to fetch full details for email {email_graph_id}")
 
@@ -88,71 +192,70 @@ def handle_process_single_email(task_payload):
             sender_address = sender_info.get('address')
             sender_name = sender_info.get('name')
             if not sender_address:
-                logging.warning(f"{log_prefix} Email missing sender address. Cannot link to Inquiry effectively.")
+                logger.warning(f"{log_prefix} Email missing sender address. Cannot link to Inquiry effectively.")
 
-            logging.info(f"{log_prefix} Extracting data...")
             extracted_data_dict, source = extract_travel_data(email_body_html)
-            logging.info(f"{log_prefix} Extraction complete. Source: {source}. Data keys: {list(extracted_data_dict.keys())}")
 
-            essential_fields = app.config.get("ESSENTIAL_EXTRACTION_FIELDS", ["first_name", "last_name", "travel_start_date", "travel_end_date", "trip_cost"])
-            missing_fields_list = [field for field in essential_fields if not extracted_data_dict.get(field)]
-            validation_status = "Incomplete" if missing_fields_list else "Complete"
-            logging.info(f"{log_prefix} Validation status: {validation_status}. Missing: {missing_fields_list}")
+            essential_fields = app.config.get("ESSENTIAL_EXTRACTION_FIELDS", DEFAULT_ESSENTIAL_FIELDS)
+            validation_status, missing_fields = _validate_extracted_data(extracted_data_dict, essential_fields)
+            logger.info("%s Extraction complete. Source: %s. Validation status: %s. Missing: %s",
+                        log_prefix, source, validation_status, missing_fields)
 
-            logging.info(f"{log_prefix} Fetching attachments list...")
             attachments_list = []
             
             # Performance optimization: Skip attachments in performance mode
             if current_app.config.get('SKIP_ATTACHMENTS_FOR_SPEED', False):
-                logging.info(f"{log_prefix} Skipping attachments fetch (performance mode enabled)")
+                logger.debug("%s Skipping attachments fetch (performance mode enabled)", log_prefix)
                 attachments_list = []
+            elif task_payload.get('attachments') is not None:
+                attachments_list = task_payload['attachments']
+            elif email_summary.get('hasAttachments') is False:
+                attachments_list = [] # Nothing to list; skip the Graph call
             else:
                 attachments_list = ms_fetch_attachments_list(email_graph_id)
 
         except Exception as fetch_extract_err:
-            logging.error(f"{log_prefix} Error during fetch/extraction: {fetch_extract_err}", exc_info=True)
+            logger.error(f"{log_prefix} Error during fetch/extraction: {fetch_extract_err}", exc_info=True)
             # Re-raise to be caught by the worker's error handling for the task
             raise
 
         # Performance tracking: Log API call duration
         api_end_time = datetime.now(timezone.utc)
         api_duration = (api_end_time - api_start_time).total_seconds()
-        logging.info(f"{log_prefix} API calls completed in {api_duration:.2f}s")
+        logger.debug("%s API calls completed in %.2fs", log_prefix, api_duration)
 
         # --- DB Operations: Inquiry finding/creation, Email creation, Data merging ---
         # Ensure this part is idempotent or handles retries gracefully if the task is re-run
-        existing_email_check = db.session.get(Email, email_graph_id)
-        if existing_email_check:
-            logging.info(f"{log_prefix} Email already exists in DB (Status: {existing_email_check.processing_status}). Assuming already processed or being processed.")
-            # Consider what to do here. If status is 'failed', maybe allow reprocessing?
-            # For now, if it exists, we skip to avoid IntegrityError.
-            # The worker should mark the task successful as this specific instance is handled.
-            return {"status": "skipped", "message": "Email already processed or processing"}
-
         inquiry = None
+        inquiry_extracted_data = None
         new_email_instance = None # Defined here for broader scope in error handling
         
         try:
             if sender_address:
-                inquiry = db.session.query(Inquiry).filter_by(primary_email_address=sender_address).first()
+                # The inquiry's ExtractedData row is joined in, so merging below needs no second SELECT
+                inquiry = db.session.scalars(
+                    select(Inquiry)
+                    .options(joinedload(Inquiry.extracted_data))
+                    .where(Inquiry.primary_email_address == sender_address)
+                    .limit(1)
+                ).first()
                 if inquiry:
-                    logging.info(f"{log_prefix} Found existing Inquiry ID {inquiry.id} for sender {sender_address}")
+                    inquiry_extracted_data = inquiry.extracted_data
+                    logger.debug("%s Found existing Inquiry ID %s for sender %s", log_prefix, inquiry.id, sender_address)
                 else:
-                    logging.info(f"{log_prefix} No existing Inquiry for {sender_address}. Creating new one.")
                     inquiry = Inquiry(primary_email_address=sender_address, status='new')
                     db.session.add(inquiry)
                     db.session.flush() # Get inquiry.id
-                    logging.info(f"{log_prefix} Created new Inquiry ID {inquiry.id}")
+                    logger.info("%s Created new Inquiry ID %s for sender %s", log_prefix, inquiry.id, sender_address)
             else:
-                logging.warning(f"{log_prefix} Skipping Inquiry link due to missing sender address.")
+                logger.warning(f"{log_prefix} Skipping Inquiry link due to missing sender address.")
 
             received_dt = None
             received_dt_str = email_summary.get('receivedDateTime')
             try:
-                if received_dt_str:
-                    received_dt = datetime.fromisoformat(received_dt_str.replace('Z', '+00:00'))
+                received_dt = _parse_graph_datetime(received_dt_str)
             except (ValueError, TypeError) as dt_err:
-                logging.warning(f"{log_prefix} Could not parse receivedDateTime '{received_dt_str}': {dt_err}")
+                logger.warning(f"{log_prefix} Could not parse receivedDateTime '{received_dt_str}': {dt_err}")
 
             new_email_instance = Email(
                 graph_id=email_graph_id,
@@ -166,22 +269,18 @@ def handle_process_single_email(task_payload):
                 inquiry_id=inquiry.id if inquiry else None
             )
             db.session.add(new_email_instance)
-            logging.info(f"{log_prefix} Prepared Email record. Intent: '{classified_intent}'. Linked to Inquiry: {inquiry.id if inquiry else 'No'}")
 
             if inquiry:
-                inquiry_extracted_data = db.session.query(ExtractedData).filter_by(inquiry_id=inquiry.id).first()
                 if not inquiry_extracted_data:
-                    logging.info(f"{log_prefix} Creating new ExtractedData for Inquiry {inquiry.id}.")
                     inquiry_extracted_data = ExtractedData(
                         inquiry_id=inquiry.id,
                         data=extracted_data_dict,
                         extraction_source=source,
                         validation_status=validation_status,
-                        missing_fields=",".join(missing_fields_list) if missing_fields_list else None
+                        missing_fields=missing_fields
                     )
                     db.session.add(inquiry_extracted_data)
                 else:
-                    logging.info(f"{log_prefix} Found existing ExtractedData for Inquiry {inquiry.id}. Merging.")
                     current_data = inquiry_extracted_data.data or {}
                     merged_data = current_data.copy()
                     updated = False
@@ -191,32 +290,30 @@ def handle_process_single_email(task_payload):
                             updated = True
                     if updated:
                         inquiry_extracted_data.data = merged_data
-                        merged_missing = [field for field in essential_fields if not merged_data.get(field)]
-                        inquiry_extracted_data.validation_status = "Incomplete" if merged_missing else "Complete"
-                        inquiry_extracted_data.missing_fields = ",".join(merged_missing) if merged_missing else None
+                        inquiry_extracted_data.validation_status, inquiry_extracted_data.missing_fields = _validate_extracted_data(merged_data, essential_fields)
                         inquiry_extracted_data.extraction_source = source # Update source if data merged
-                        logging.info(f"{log_prefix} Merged data updated for Inquiry {inquiry.id}. New status: {inquiry_extracted_data.validation_status}")
+                        logger.debug("%s Merged new data into Inquiry %s. New status: %s", log_prefix, inquiry.id, inquiry_extracted_data.validation_status)
                     else:
-                        logging.info(f"{log_prefix} No new data merged for Inquiry {inquiry.id}.")
+                        logger.debug("%s No new data merged for Inquiry %s.", log_prefix, inquiry.id)
             
+            attachment_rows = []
             if attachments_list:
-                logging.debug(f"{log_prefix} Processing {len(attachments_list)} attachments.")
                 for att_meta in attachments_list:
                     att_graph_id = att_meta.get('id')
                     if not att_graph_id:
-                        logging.warning(f"{log_prefix} Attachment missing ID. Skipping.")
+                        logger.warning(f"{log_prefix} Attachment missing ID. Skipping.")
                         continue
-                    existing_att = db.session.get(AttachmentMetadata, att_graph_id)
-                    if not existing_att:
-                        new_att = AttachmentMetadata(
-                            graph_id=att_graph_id,
-                            email_graph_id=email_graph_id,
-                            name=att_meta.get('name'),
-                            content_type=att_meta.get('contentType'),
-                            size_bytes=att_meta.get('size')
-                        )
-                        db.session.add(new_att)
-                        logging.debug(f"{log_prefix} Prepared AttachmentMetadata: {att_meta.get('name')}")
+                    attachment_rows.append({
+                        "graph_id": att_graph_id,
+                        "email_graph_id": email_graph_id,
+                        "name": att_meta.get('name'),
+                        "content_type": att_meta.get('contentType'),
+                        "size_bytes": att_meta.get('size')
+                    })
+                if attachment_rows:
+                    db.session.flush() # The Email row must exist before its attachments
+                    # One INSERT for all attachments; already-stored ones are skipped
+                    _insert_ignoring_duplicates(db.session, AttachmentMetadata, attachment_rows)
 
             new_email_instance.processing_status = 'processed'
             new_email_instance.processed_at = datetime.now(timezone.utc)
@@ -229,18 +326,20 @@ def handle_process_single_email(task_payload):
             # Performance tracking: Log total processing time
             processing_end_time = datetime.now(timezone.utc)
             total_duration = (processing_end_time - processing_start_time).total_seconds()
-            logging.info(f"{log_prefix} Successfully processed and committed to DB. Total time: {total_duration:.2f}s")
+            # One summary line per email instead of a line per step
+            logger.info("%s Processed in %.2fs. Intent: '%s'. Inquiry: %s. Attachments: %d.",
+                        log_prefix, total_duration, classified_intent, inquiry.id if inquiry else 'none', len(attachment_rows))
             
             return {"status": "success", "inquiry_id": inquiry.id if inquiry else None, "processing_time": total_duration}
 
         except IntegrityError as ie:
             db.session.rollback()
-            logging.error(f"{log_prefix} Database integrity error: {ie}", exc_info=True)
+            logger.error(f"{log_prefix} Database integrity error: {ie}", exc_info=True)
             # Check if the email record exists, if so, it's a duplicate scenario.
             # If it was another IntegrityError (e.g. attachment ID), the new_email_instance might exist
             # and should be marked as failed if possible or the task should be marked failed.
             if db.session.get(Email, email_graph_id):
-                 logging.warning(f"{log_prefix} IntegrityError likely due to duplicate email ID. Marking as skipped.")
+                 logger.warning(f"{log_prefix} IntegrityError likely due to duplicate email ID. Marking as skipped.")
                  # If email exists, this specific attempt can be considered 'handled' to avoid retry loops on duplicates.
                  # The worker will then mark the task as successful or skipped.
                  return {"status": "skipped", "message": f"Duplicate entry detected (IntegrityError): {ie}"}
@@ -255,12 +354,12 @@ def handle_process_single_email(task_payload):
                         db.session.commit()
                     except Exception as final_commit_err:
                         db.session.rollback()
-                        logging.error(f"{log_prefix} Could not even commit failed status after IntegrityError: {final_commit_err}")
+                        logger.error(f"{log_prefix} Could not even commit failed status after IntegrityError: {final_commit_err}")
                 raise # Re-raise for the worker to mark the task as failed
         
         except Exception as db_err:
             db.session.rollback()
-            logging.error(f"{log_prefix} Unhandled database error: {db_err}", exc_info=True)
+            logger.error(f"{log_prefix} Unhandled database error: {db_err}", exc_info=True)
             if new_email_instance and new_email_instance.graph_id: # if email object was created with an ID
                 # Attempt to mark the email as failed in the DB if it was created
                 try:
@@ -274,99 +373,154 @@ def handle_process_single_email(task_payload):
                     email_to_fail.processing_error = f"DB Error: {str(db_err)[:1000]}" # Truncate error
                     email_to_fail.processed_at = datetime.now(timezone.utc)
                     db.session.commit()
-                    logging.info(f"{log_prefix} Marked email as 'failed' in DB due to unhandled error.")
+                    logger.info(f"{log_prefix} Marked email as 'failed' in DB due to unhandled error.")
                 except Exception as log_err:
                     db.session.rollback()
-                    logging.error(f"{log_prefix} Error during error handling for DB exception: Could not mark email as failed. {log_err}")
+                    logger.error(f"{log_prefix} Error during error handling for DB exception: Could not mark email as failed. {log_err}")
             raise # Re-raise for the worker to mark the task as failed
 
 
+# Bounded pool for the poller's per-email remote calls. 4 matches Outlook's per-mailbox
+# concurrent request limit; worker threads are started on first use.
+# Jobs submitted here must not touch db.session: it is scoped to the submitting thread's
+# app context, and pool threads have none. Fetch/classify in the pool, then read and
+# write the database from the polling thread once the results are back.
+EMAIL_WORKER_THREADS = 4
+_email_worker_pool = ThreadPoolExecutor(max_workers=EMAIL_WORKER_THREADS, thread_name_prefix="EmailWorker")
+
+def _classify_summary(email_summary):
+    """Classify one email summary's intent, falling back to a default on errors."""
+    email_graph_id = email_summary.get('id')
+    classified_intent = "Unknown Intent" # Default intent
+    try:
+        classified_intent = classify_email_intent(email_summary.get('subject', ''), email_summary.get('bodyPreview', ''))
+        logger.debug("[EmailPoller] Classified intent for %s: '%s'", email_graph_id, classified_intent)
+    except Exception as classify_err:
+        logger.error(f"[EmailPoller] Failed to classify intent for {email_graph_id}: {classify_err}. Using default intent: '{classified_intent}'", exc_info=True)
+    return classified_intent
+
 def poll_new_emails(app_instance):
     """
-    Checks for new emails since the last check, classifies them, and creates
-    PendingTask entries for them to be processed by the Postgres-based worker.
+    Fetches inbox changes since the last Graph delta sync, classifies new emails, and
+    creates PendingTask entries for them to be processed by the Postgres-based worker.
     This function is intended to be called by a scheduled task (e.g., from APScheduler via a PendingTask).
     Args:
         app_instance: The Flask app instance.
+    Returns:
+        int: The number of PendingTasks queued by this cycle.
     """
-    global last_checked_timestamp
-    # Note: db and PendingTask model are imported within app_context
-    
-    with app_instance.app_context():
-        from . import db
-        from .models import PendingTask
-
-        logging.info("[EmailPoller] Starting poll cycle (Postgres Task Queuing).")
-        if last_checked_timestamp is None:
-            # On first run, check for emails from the last 7 days (or a configurable period)
-            # Consider storing this in DB (e.g., a 'settings' table or oldest PendingTask check time)
-            # For now, using timedelta similar to before.
-            default_catchup_days = app_instance.config.get('INITIAL_POLL_CATCHUP_DAYS', 7)
-            since_timestamp = datetime.now(timezone.utc) - timedelta(days=default_catchup_days)
-            logging.info(f"[EmailPoller] First run or missing timestamp: checking emails since {default_catchup_days} days ago.")
-        else:
-            since_timestamp = last_checked_timestamp
-            logging.info(f"[EmailPoller] Checking emails since {since_timestamp.isoformat()}")
-        
-        current_check_time = datetime.now(timezone.utc) # Timestamp before fetching
+    with _app_context(app_instance):
+        logger.info("[EmailPoller] Starting poll cycle (Postgres Task Queuing).")
+        poller_state = {
+            state.key: state.value for state in db.session.scalars(
+                select(PollerState).where(PollerState.key.in_([INBOX_DELTA_LINK_KEY, EMPTY_POLLS_KEY]))
+            )
+        }
+        delta_link = poller_state.get(INBOX_DELTA_LINK_KEY)
+        # A fresh sync starts from the last 7 days (or a configurable period). The window is
+        # passed even with a stored link, so a sync restarted after 410 Gone keeps it too
+        # instead of pulling in the whole inbox.
+        default_catchup_days = app_instance.config.get('INITIAL_POLL_CATCHUP_DAYS', 7)
+        since_timestamp = datetime.now(timezone.utc) - timedelta(days=default_catchup_days)
+        if not delta_link:
+            logger.info(f"[EmailPoller] No stored delta link: starting sync from {default_catchup_days} days ago.")
 
         try:
-            new_email_summaries = ms_fetch_new_emails_since(since_timestamp)
+            task_rows = []
+            new_email_summaries, next_delta_link = ms_fetch_email_delta(delta_link, since=since_timestamp)
+            if new_email_summaries:
+                # Delta also returns changed messages (e.g. marked read); drop ones already stored
+                # with a single IN query before spending Graph/OpenAI calls on them
+                summary_ids = [summary['id'] for summary in new_email_summaries if summary.get('id')]
+                stored_ids = set(db.session.scalars(select(Email.graph_id).where(Email.graph_id.in_(summary_ids))))
+                if stored_ids:
+                    logger.info(f"[EmailPoller] Skipping {len(stored_ids)} email(s) already stored.")
+                    new_email_summaries = [summary for summary in new_email_summaries if summary.get('id') not in stored_ids]
 
             if not new_email_summaries:
-                logging.info("[EmailPoller] No new emails found.")
+                logger.info("[EmailPoller] No new emails found.")
             else:
-                logging.info(f"[EmailPoller] Found {len(new_email_summaries)} new email(s). Classifying and creating tasks...")
-                created_task_count = 0
+                logger.info(f"[EmailPoller] Found {len(new_email_summaries)} new email(s). Classifying and creating tasks...")
+                summaries_with_id = [summary for summary in new_email_summaries if summary.get('id')]
+                # Fetch full details (and attachment lists) for the whole poll in a few $batch
+                # round trips instead of two Graph calls per email in the worker
+                # Attachment lists are only requested for messages Graph flags with hasAttachments
+                # The prefetch runs on the worker pool so its Graph round trips overlap with the
+                # OpenAI classification calls below
+                prefetch_future = _email_worker_pool.submit(
+                    ms_fetch_details_and_attachments_batch,
+                    [summary['id'] for summary in summaries_with_id],
+                    include_attachments=not app_instance.config.get('SKIP_ATTACHMENTS_FOR_SPEED', False),
+                    attachment_email_ids={summary['id'] for summary in summaries_with_id if summary.get('hasAttachments', True)}
+                )
+                # Classify intents concurrently (each is an OpenAI round trip); tasks are still
+                # created in received order below
+                classified_intents = dict(zip(
+                    (summary['id'] for summary in summaries_with_id),
+                    _email_worker_pool.map(_classify_summary, summaries_with_id)
+                ))
+                prefetched = prefetch_future.result()
+                scheduled_for = datetime.now(timezone.utc) # Process ASAP
                 for email_summary in new_email_summaries:
                     email_graph_id = email_summary.get('id')
-                    email_subject = email_summary.get('subject', '')
-                    email_snippet = email_summary.get('bodyPreview', '')
                     if not email_graph_id:
-                        logging.warning("[EmailPoller] Skipping email summary with no ID.")
+                        logger.warning("[EmailPoller] Skipping email summary with no ID.")
                         continue
 
-                    # Classify intent
-                    classified_intent = "Unknown Intent" # Default intent
-                    try:
-                        classified_intent = classify_email_intent(email_subject, email_snippet)
-                        logging.info(f"[EmailPoller] Classified intent for {email_graph_id}: '{classified_intent}'")
-                    except Exception as classify_err:
-                        logging.error(f"[EmailPoller] Failed to classify intent for {email_graph_id}: {classify_err}. Using default intent: '{classified_intent}'", exc_info=True)
-                        # classified_intent is already set to default, so we just log and proceed.
+                    classified_intent = classified_intents[email_graph_id]
 
                     # Create PendingTask
                     task_payload = {
                         "email_summary": email_summary,
                         "classified_intent": classified_intent
                     }
-                    new_pending_task = PendingTask(
-                        task_type='process_single_email',
-                        payload=task_payload,
-                        status='pending',
-                        scheduled_for=datetime.now(timezone.utc) # Process ASAP
-                    )
-                    try:
-                        db.session.add(new_pending_task)
-                        db.session.commit() # Commit each task individually
-                        logging.info(f"[EmailPoller] Created PendingTask for email {email_graph_id}.")
-                        created_task_count += 1
-                    except Exception as db_task_err:
-                        db.session.rollback()
-                        logging.error(f"[EmailPoller] Failed to create PendingTask for email {email_graph_id}: {db_task_err}", exc_info=True)
-                        # If one task creation fails, we continue to the next email.
-                        # The overall poll cycle will still update `last_checked_timestamp` if it doesn't hard crash.
-
-                logging.info(f"[EmailPoller] Finished creating {created_task_count} PendingTasks.")
-
-            # Update timestamp only after a successful poll cycle (even if no emails/tasks created)
-            last_checked_timestamp = current_check_time
+                    email_details, attachments = prefetched.get(email_graph_id, (None, None))
+                    if email_details:
+                        task_payload["email_details"] = email_details
+                    if attachments is not None:
+                        task_payload["attachments"] = attachments
+                    elif email_summary.get('hasAttachments') is False:
+                        task_payload["attachments"] = []
+                    task_rows.append({
+                        "task_type": 'process_single_email',
+                        "payload": task_payload,
+                        "status": 'pending',
+                        "scheduled_for": scheduled_for
+                    })
+
+                if task_rows:
+                    # One multi-row INSERT for the whole poll cycle, committed below together with
+                    # the delta link so a failed cycle is retried in full rather than half-queued
+                    db.session.execute(insert(PendingTask), task_rows)
+                logger.info(f"[EmailPoller] Prepared {len(task_rows)} PendingTasks.")
+
+            # Adaptive interval: each empty poll doubles the wait (up to POLL_MAX_INTERVAL_SECONDS),
+            # a hit drops straight back to the base interval so bursts are picked up quickly.
+            # The scheduled trigger fires every base interval and skips ticks until the backoff expires.
+            # Only reached when the delta call succeeded: Graph errors propagate to the handler below,
+            # so an outage or throttling fails the poll task instead of counting as a quiet mailbox.
             poll_interval = app_instance.config.get('POLL_INTERVAL_SECONDS', 300) # Default to 5 mins for Postgres tasks
-            logging.info(f"[EmailPoller] Poll cycle complete. Next check will be based on schedule (current time: {current_check_time.isoformat()}, interval: {poll_interval}s).")
+            max_poll_interval = app_instance.config.get('POLL_MAX_INTERVAL_SECONDS', MAX_POLL_INTERVAL_SECONDS)
+            empty_polls = 0 if task_rows else int(poller_state.get(EMPTY_POLLS_KEY) or 0) + 1
+            next_interval = _next_poll_interval(poll_interval, empty_polls, max_poll_interval)
+            backoff_until = datetime.now(timezone.utc) + timedelta(seconds=next_interval - poll_interval)
+            state_updates = {
+                EMPTY_POLLS_KEY: str(empty_polls),
+                POLL_BACKOFF_UNTIL_KEY: backoff_until.isoformat()
+            }
+            # Store the delta link only after a successful poll cycle (even if no emails/tasks created)
+            if next_delta_link and next_delta_link != delta_link:
+                state_updates[INBOX_DELTA_LINK_KEY] = next_delta_link
+            # Upserted in the same transaction as the queued tasks
+            _upsert_poller_state(db.session, PollerState, state_updates)
+            db.session.commit()
+            logger.info(f"[EmailPoller] Poll cycle complete. Next scheduled check in about {next_interval}s ({empty_polls} empty poll(s) in a row).")
+            return len(task_rows)
 
         except Exception as poll_err:
-            logging.error(f"[EmailPoller] Error during email polling cycle: {poll_err}", exc_info=True)
-            # Do not update last_checked_timestamp on error, so the APScheduler task will retry from the same point next time.
+            db.session.rollback()
+            logger.error(f"[EmailPoller] Error during email polling cycle: {poll_err}", exc_info=True)
+            # Do not store a new delta link on error, so the next poll resumes from the same point.
             # This function should re-raise the error if it's called from the Postgres worker via a 'poll_all_new_emails' task,
             # so the worker can mark that specific polling task as failed.
             raise
@@ -380,46 +534,70 @@ def poll_new_emails(app_instance):
 # def start_background_polling(app): ...
 # def shutdown_background_polling(): ...
 
-# Placeholder for a task that triggers polling, to be called by APScheduler
-def trigger_email_polling_task_creation():
-    """
-    Scheduled job to create a 'poll_all_new_emails' task in the PendingTask table.
-    This function needs to establish its own Flask app context to interact with the database
-    when run by APScheduler.
+@functools.cache
+def _scheduler_job_app():
+    """Flask app used by APScheduler callbacks, created once per process.
+
+    Jobs are stored in the SQLAlchemy job store, so they cannot carry the app as an
+    argument; building a fresh app on every tick would also create a new engine and
+    connection pool each time.
     """
     # Import the app factory function.
     # This assumes create_app is in app/__init__.py, which is standard.
-    from app import create_app 
+    from app import create_app
+    return create_app()
 
-    # Create a new Flask app instance specifically for this job.
-    # This ensures that the job has a valid application context.
-    # Note: If create_app() is not idempotent for certain initializations (e.g., re-adding scheduler jobs
-    # without 'replace_existing=True', or re-initializing extensions in a conflicting way),
-    # this might have side effects. However, it's a common pattern for providing context
-    # to background jobs when not using an extension like Flask-APScheduler.
-    job_app = create_app()
+# Scheduled every POLL_INTERVAL_SECONDS by APScheduler (see create_app)
+def trigger_email_polling_task_creation():
+    """
+    Scheduled job to create a 'poll_all_new_emails' task in the PendingTask table.
+    It runs on an APScheduler thread, so it enters the (cached) job app's context
+    to interact with the database.
+    """
+    job_app = _scheduler_job_app()
 
     if not job_app:
-        logging.error("[SchedulerCallback] Failed to create Flask app instance via create_app() for trigger_email_polling_task_creation. Task creation will be skipped.")
+        logger.error("[SchedulerCallback] Failed to create Flask app instance via create_app() for trigger_email_polling_task_creation. Task creation will be skipped.")
         return
 
-    with job_app.app_context():
-        # Now that we are within an app context, we can safely import and use app-bound extensions.
-        from . import db  # Imports db associated with job_app
-        from .models import PendingTask # Imports models related to job_app's SQLAlchemy instance
+    with _app_context(job_app):
+        backoff_state = db.session.get(PollerState, POLL_BACKOFF_UNTIL_KEY)
+        if backoff_state and backoff_state.value and datetime.now(timezone.utc) < _parse_graph_datetime(backoff_state.value):
+            logger.debug("[SchedulerCallback] Mailbox has been quiet; skipping poll until %s.", backoff_state.value)
+            return
+        # Don't pile up poll tasks while the worker is busy or down. A 'processing' row is only
+        # trusted for POLL_TASK_STALE_SECONDS: nothing resets a task whose worker was killed
+        # mid-poll, and it must not stop scheduled polling for good.
+        stale_seconds = job_app.config.get('POLL_TASK_STALE_SECONDS', POLL_TASK_STALE_SECONDS)
+        stale_before = datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)
+        queued_poll_id = db.session.scalar(
+            select(PendingTask.id)
+            .where(
+                PendingTask.task_type == 'poll_all_new_emails',
+                or_(
+                    PendingTask.status == 'pending',
+                    and_(PendingTask.status == 'processing',
+                         func.coalesce(PendingTask.scheduled_for, PendingTask.created_at) >= stale_before)
+                )
+            )
+            .limit(1)
+        )
+        if queued_poll_id is not None:
+            logger.debug("[SchedulerCallback] Poll task %s is still queued; not creating another.", queued_poll_id)
+            return
 
-        logging.info("[SchedulerCallback] APScheduler triggered: Creating a 'poll_all_new_emails' task.")
+        logger.info("[SchedulerCallback] APScheduler triggered: Creating a 'poll_all_new_emails' task.")
         try:
             new_task = PendingTask(task_type='poll_all_new_emails', payload={})
             db.session.add(new_task)
             db.session.commit()
-            logging.info(f"[SchedulerCallback] Successfully created PendingTask ID {new_task.id} for email polling.")
+            logger.info(f"[SchedulerCallback] Successfully created PendingTask ID {new_task.id} for email polling.")
         except IntegrityError as e:
             db.session.rollback()
-            logging.error(f"[SchedulerCallback] IntegrityError when creating polling task: {e}. This might indicate an issue with task uniqueness or DB connection.", exc_info=True)
+            logger.error(f"[SchedulerCallback] IntegrityError when creating polling task: {e}. This might indicate an issue with task uniqueness or DB connection.", exc_info=True)
         except Exception as e:
             db.session.rollback()
-            logging.error(f"[SchedulerCallback] Failed to create 'poll_all_new_emails' task due to: {e}", exc_info=True)
+            logger.error(f"[SchedulerCallback] Failed to create 'poll_all_new_emails' task due to: {e}", exc_info=True)
 
 # New function to handle WhatsApp messages:
 def handle_new_whatsapp_message(payload, app_for_context_param):
@@ -436,13 +614,10 @@ def handle_new_whatsapp_message(payload, app_for_context_param):
     # Correct way to use app context for background tasks if not already in one:
     app = current_app._get_current_object() if current_app else app_for_context_param
     
-    with app.app_context():
-        from . import db
-        from .models import Inquiry, WhatsAppMessage, ExtractedData, User # Assuming User might be needed for 'updated_by'
-
+    with _app_context(app):
         log_prefix = "[WhatsAppHandler]"
-        logging.info(f"{log_prefix} Starting processing of new WhatsApp message.")
-        logging.debug(f"{log_prefix} Received payload: {payload}")
+        logger.info(f"{log_prefix} Starting processing of new WhatsApp message.")
+        logger.debug("%s Received payload: %s", log_prefix, payload)
 
         # Extract primary identifiers from payload (adjust keys based on actual Green API structure)
         # These are examples based on common Green API payload structures.
@@ -505,7 +680,7 @@ def handle_new_whatsapp_message(payload, app_for_context_param):
             try:
                 wa_datetime = datetime.fromtimestamp(int(wa_timestamp_from_payload), tz=timezone.utc)
             except (ValueError, TypeError) as e:
-                logging.warning(f"{log_prefix} Could not parse Green API timestamp '{wa_timestamp_from_payload}': {e}")
+                logger.warning(f"{log_prefix} Could not parse Green API timestamp '{wa_timestamp_from_payload}': {e}")
 
         from_me = False # For incoming, this should generally be False.
                         # GreenAPI's `sender` vs `instanceData.wid` can determine if it's an echo of an outgoing msg.
@@ -513,12 +688,12 @@ def handle_new_whatsapp_message(payload, app_for_context_param):
             # This logic might need refinement based on how GreenAPI handles echoes of outgoing messages vs. true incoming.
             # Typically, webhooks are for *incoming* messages from others.
             # If 'senderData.sender' is the API's own WID, it's an echo of an outgoing message.
-            logging.info(f"{log_prefix} Message sender {sender} matches instance WID. Likely an echo of an outgoing message. Setting from_me=True.")
+            logger.info(f"{log_prefix} Message sender {sender} matches instance WID. Likely an echo of an outgoing message. Setting from_me=True.")
             from_me = True
             # Decide if you want to process echoes of your own messages. For now, we will.
 
         if not id_message or not chat_id or not sender:
-            logging.error(f"{log_prefix} Essential fields missing from payload: idMessage, chatId, or sender. Payload: {payload}")
+            logger.error(f"{log_prefix} Essential fields missing from payload: idMessage, chatId, or sender. Payload: {payload}")
             raise ValueError("Essential WhatsApp message identifiers missing in payload")
 
         # --- Inquiry lookup/creation --- 
@@ -531,7 +706,7 @@ def handle_new_whatsapp_message(payload, app_for_context_param):
             inquiry = db.session.query(Inquiry).filter_by(primary_email_address=inquiry_identifier_email).first()
             new_inquiry_created = False
             if not inquiry:
-                logging.info(f"{log_prefix} No existing Inquiry for identifier {inquiry_identifier_email}. Creating new one.")
+                logger.info(f"{log_prefix} No existing Inquiry for identifier {inquiry_identifier_email}. Creating new one.")
                 inquiry = Inquiry(
                     primary_email_address=inquiry_identifier_email,
                     status='new_whatsapp' # Initial status for new WhatsApp inquiries
@@ -539,9 +714,9 @@ def handle_new_whatsapp_message(payload, app_for_context_param):
                 db.session.add(inquiry)
                 db.session.flush() # Get inquiry.id before linking WhatsAppMessage
                 new_inquiry_created = True
-                logging.info(f"{log_prefix} Created new Inquiry ID {inquiry.id}")
+                logger.info(f"{log_prefix} Created new Inquiry ID {inquiry.id}")
             else:
-                logging.info(f"{log_prefix} Found existing Inquiry ID {inquiry.id} for identifier {inquiry_identifier_email}")
+                logger.info(f"{log_prefix} Found existing Inquiry ID {inquiry.id} for identifier {inquiry_identifier_email}")
                 # Optionally update inquiry status if it was, e.g., 'Complete' and now gets a new message
                 if inquiry.status not in ['new_whatsapp', 'Processing', 'Incomplete']: # Example: don't overwrite these
                     pass # Or set to 'new_whatsapp' / 'Follow-up'
@@ -551,7 +726,7 @@ def handle_new_whatsapp_message(payload, app_for_context_param):
             # Check if this specific message ID already exists for this inquiry to prevent duplicates
             existing_wa_message = db.session.query(WhatsAppMessage).filter_by(id=id_message).first()
             if existing_wa_message:
-                logging.warning(f"{log_prefix} WhatsApp message with ID {id_message} already exists. Skipping creation. Status: {existing_wa_message.message_type}")
+                logger.warning(f"{log_prefix} WhatsApp message with ID {id_message} already exists. Skipping creation. Status: {existing_wa_message.message_type}")
                 # This specific message is a duplicate, but the task for PendingTask can be marked successful.
                 return {"status": "skipped", "message": "WhatsApp message already processed (duplicate ID)"}
 
@@ -572,7 +747,7 @@ def handle_new_whatsapp_message(payload, app_for_context_param):
                 # raw_payload=payload # Optional: store the full JSON if needed for debugging or reprocessing
             )
             db.session.add(new_wa_message)
-            logging.info(f"{log_prefix} Prepared WhatsAppMessage record for ID {id_message}. Linked to Inquiry ID {inquiry.id}.")
+            logger.info(f"{log_prefix} Prepared WhatsAppMessage record for ID {id_message}. Linked to Inquiry ID {inquiry.id}.")
 
             # --- Data Extraction (only if there's text content) ---
             extracted_data_dict = None
@@ -580,35 +755,34 @@ def handle_new_whatsapp_message(payload, app_for_context_param):
             current_validation_status = inquiry.status # Preserve current inquiry status before potential update
 
             if text_message:
-                logging.info(f"{log_prefix} Attempting data extraction from text: \"{text_message[:100]}...\"")
+                logger.info(f"{log_prefix} Attempting data extraction from text: \"{text_message[:100]}...\"")
                 try:
                     extracted_data_dict, extraction_source = extract_travel_data(text_message) # Assuming text input
-                    logging.info(f"{log_prefix} Extraction complete. Source: {extraction_source}. Data keys: {list(extracted_data_dict.keys() if extracted_data_dict else [])}")
+                    logger.info(f"{log_prefix} Extraction complete. Source: {extraction_source}. Data keys: {list(extracted_data_dict.keys() if extracted_data_dict else [])}")
                 except Exception as extract_err:
-                    logging.error(f"{log_prefix} Error during data extraction: {extract_err}", exc_info=True)
+                    logger.error(f"{log_prefix} Error during data extraction: {extract_err}", exc_info=True)
                     # Proceed without extracted data, but log the error.
                     # The inquiry status might remain 'new_whatsapp' or 'Incomplete'.
             else:
-                logging.info(f"{log_prefix} No text message content for data extraction (Type: {type_message}).")
+                logger.info(f"{log_prefix} No text message content for data extraction (Type: {type_message}).")
 
             # --- Upsert ExtractedData & Update Inquiry Status ---
             if extracted_data_dict:
-                essential_fields = app.config.get("ESSENTIAL_EXTRACTION_FIELDS", ["first_name", "last_name", "travel_start_date", "travel_end_date", "trip_cost"])
+                essential_fields = app.config.get("ESSENTIAL_EXTRACTION_FIELDS", DEFAULT_ESSENTIAL_FIELDS)
                 inquiry_extracted_data = db.session.query(ExtractedData).filter_by(inquiry_id=inquiry.id).first()
                 if not inquiry_extracted_data:
-                    logging.info(f"{log_prefix} Creating new ExtractedData for Inquiry {inquiry.id}.")
-                    missing_fields_list = [field for field in essential_fields if not extracted_data_dict.get(field)]
-                    current_validation_status = "Incomplete" if missing_fields_list else "Complete"
+                    logger.info(f"{log_prefix} Creating new ExtractedData for Inquiry {inquiry.id}.")
+                    current_validation_status, missing_fields = _validate_extracted_data(extracted_data_dict, essential_fields)
                     inquiry_extracted_data = ExtractedData(
                         inquiry_id=inquiry.id,
                         data=extracted_data_dict,
                         extraction_source=extraction_source or 'whatsapp_initial_extraction',
                         validation_status=current_validation_status,
-                        missing_fields=",".join(missing_fields_list) if missing_fields_list else None
+                        missing_fields=missing_fields
                     )
                     db.session.add(inquiry_extracted_data)
                 else:
-                    logging.info(f"{log_prefix} Found existing ExtractedData for Inquiry {inquiry.id}. Merging.")
+                    logger.info(f"{log_prefix} Found existing ExtractedData for Inquiry {inquiry.id}. Merging.")
                     current_db_data = inquiry_extracted_data.data or {}
                     merged_data = current_db_data.copy()
                     updated = False
@@ -619,40 +793,38 @@ def handle_new_whatsapp_message(payload, app_for_context_param):
                     if updated:
                         inquiry_extracted_data.data = merged_data
                         # Re-validate after merge
-                        merged_missing = [field for field in essential_fields if not merged_data.get(field)]
-                        current_validation_status = "Incomplete" if merged_missing else "Complete"
-                        inquiry_extracted_data.missing_fields = ",".join(merged_missing) if merged_missing else None
+                        current_validation_status, inquiry_extracted_data.missing_fields = _validate_extracted_data(merged_data, essential_fields)
                         inquiry_extracted_data.extraction_source = extraction_source or 'whatsapp_merged_extraction' # Update source
-                        logging.info(f"{log_prefix} Merged data updated. New validation status for ExtractedData: {current_validation_status}")
+                        logger.info(f"{log_prefix} Merged data updated. New validation status for ExtractedData: {current_validation_status}")
                     else:
-                        logging.info(f"{log_prefix} No new data merged into ExtractedData for Inquiry {inquiry.id}.")
+                        logger.info(f"{log_prefix} No new data merged into ExtractedData for Inquiry {inquiry.id}.")
                         # Use existing validation status if no new data merged
                         current_validation_status = inquiry_extracted_data.validation_status 
                 
                 # Update Inquiry status based on extraction results
                 inquiry.status = current_validation_status
-                logging.info(f"{log_prefix} Updated Inquiry {inquiry.id} status to '{inquiry.status}' based on extraction.")
+                logger.info(f"{log_prefix} Updated Inquiry {inquiry.id} status to '{inquiry.status}' based on extraction.")
             elif new_inquiry_created: # No data extracted, but it's a new inquiry from WhatsApp
                 inquiry.status = 'new_whatsapp' # Remains 'new_whatsapp' or could be 'Incomplete' if preferred
-                logging.info(f"{log_prefix} No data extracted. Inquiry {inquiry.id} status remains/set to '{inquiry.status}'.")
+                logger.info(f"{log_prefix} No data extracted. Inquiry {inquiry.id} status remains/set to '{inquiry.status}'.")
             # If not new_inquiry_created and no data extracted, inquiry status remains as it was before this message.
 
             db.session.commit()
-            logging.info(f"{log_prefix} Successfully processed WhatsApp message ID {id_message} and committed to DB.")
+            logger.info(f"{log_prefix} Successfully processed WhatsApp message ID {id_message} and committed to DB.")
             return {"status": "success", "inquiry_id": inquiry.id, "whatsapp_message_id": new_wa_message.id}
 
         except IntegrityError as ie:
             db.session.rollback()
             # Check if it's a duplicate WhatsAppMessage ID error
             if "whatsapp_messages_pkey" in str(ie).lower() or (id_message and db.session.query(WhatsAppMessage).get(id_message)):
-                logging.warning(f"{log_prefix} IntegrityError likely due to duplicate WhatsApp Message ID {id_message}. Marking as skipped. Error: {ie}")
+                logger.warning(f"{log_prefix} IntegrityError likely due to duplicate WhatsApp Message ID {id_message}. Marking as skipped. Error: {ie}")
                 return {"status": "skipped", "message": f"Duplicate WhatsApp message ID {id_message}"}
             else:
-                logging.error(f"{log_prefix} Database integrity error during WhatsApp processing: {ie}", exc_info=True)
+                logger.error(f"{log_prefix} Database integrity error during WhatsApp processing: {ie}", exc_info=True)
                 raise # Re-raise for the main task handler to mark PendingTask as failed
         except Exception as e:
             db.session.rollback()
-            logging.error(f"{log_prefix} Unhandled error processing WhatsApp message: {e}", exc_info=True)
+            logger.error(f"{log_prefix} Unhandled error processing WhatsApp message: {e}", exc_info=True)
             raise # Re-raise for the main task handler
 
 
@@ -666,7 +838,7 @@ def handle_task(task_type, payload, app_for_context):
         payload (dict): The payload for the task.
         app_for_context: The Flask application instance for establishing context.
     """
-    logging.info(f"[TaskDispatcher] Received task: {task_type}")
+    logger.info(f"[TaskDispatcher] Received task: {task_type}")
     # Ensure we are operating within the provided app_context
     # The caller (e.g., Postgres worker) should establish the app_context before calling this.
     # However, if app_for_context is passed, we should use it to ensure context is correct.
@@ -682,13 +854,13 @@ def handle_task(task_type, payload, app_for_context):
         return handle_process_single_email(payload)
     elif task_type == 'poll_all_new_emails':
         # poll_new_emails takes app_instance and establishes context
-        logging.info(f"[TaskDispatcher] Handling 'poll_all_new_emails' task.")
-        poll_new_emails(app_for_context) 
-        return {"status": "success", "message": "Email polling cycle initiated/completed."}
+        logger.info(f"[TaskDispatcher] Handling 'poll_all_new_emails' task.")
+        queued_count = poll_new_emails(app_for_context)
+        return {"status": "success", "message": "Email polling cycle initiated/completed.", "queued": queued_count}
     elif task_type == 'new_whatsapp_message':
-        logging.info(f"[TaskDispatcher] Handling 'new_whatsapp_message' task.")
+        logger.info(f"[TaskDispatcher] Handling 'new_whatsapp_message' task.")
         # Pass the app_for_context to the new handler
         return handle_new_whatsapp_message(payload, app_for_context)
     else:
-        logging.error(f"[TaskDispatcher] Unknown task type: {task_type}")
+        logger.error(f"[TaskDispatcher] Unknown task type: {task_type}")
         raise ValueError(f"Unknown task type: {task_type}") 
\ No newline at end of file
@@ -1,13 +1,16 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_migrate import Migrate
+from flask_compress import Compress
 from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from datetime import timezone # Import timezone
  
 # Initialize extensions here
 db = SQLAlchemy()
 login_manager = LoginManager()
 migrate = Migrate() 
-# Configure scheduler to use UTC timezone to avoid pickling issues with ZoneInfo
-scheduler = BackgroundScheduler(timezone=timezone.utc) # Default to BackgroundScheduler 
\ No newline at end of file
+compress = Compress()
+# Configure scheduler to use UTC timezone to avoid pickling issues with ZoneInfo.
+# coalesce collapses runs missed during a pause (e.g. a suspended container) into one,
+# and max_instances=1 keeps a slow run from overlapping the next.
+scheduler = BackgroundScheduler(timezone=timezone.utc, job_defaults={'coalesce': True, 'max_instances': 1})
\ No newline at end of file
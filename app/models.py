@@ -3,7 +3,7 @@ from flask_login import UserMixin, current_user
 from .extensions import db  # Import db from the extensions package (__init__.py)
 from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import func
+from sqlalchemy import DDL, event, func
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -17,6 +17,20 @@ class User(UserMixin, db.Model):
 
 class Inquiry(db.Model):
     __tablename__ = 'inquiries'
+    __table_args__ = (
+        # Dashboards filter on status and sort by most recently updated
+        db.Index('ix_inquiries_status_updated_at', 'status', 'updated_at'),
+        db.Index('ix_inquiries_updated_at_created_at', 'updated_at', 'created_at'),
+        # Partial indexes for the statuses staff filter on most (PostgreSQL only)
+        db.Index('ix_inquiries_incomplete_updated_at', 'updated_at',
+                 postgresql_where=db.text("status = 'Incomplete'")),
+        db.Index('ix_inquiries_error_updated_at', 'updated_at',
+                 postgresql_where=db.text("status = 'Error'")),
+        # Trigram index so substring search (ILIKE '%term%') can use an index (PostgreSQL only)
+        db.Index('ix_inquiries_primary_email_address_trgm', 'primary_email_address',
+                 postgresql_using='gin',
+                 postgresql_ops={'primary_email_address': 'gin_trgm_ops'}).ddl_if(dialect='postgresql'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     primary_email_address = db.Column(db.String(120), nullable=False, index=True)
@@ -60,6 +74,12 @@ class Inquiry(db.Model):
     def __repr__(self):
         return f'<Inquiry {self.id} for {self.primary_email_address}>'
 
+# create_all() (e.g. `flask init-db`) needs pg_trgm before the trigram index above can be built
+event.listen(
+    Inquiry.__table__, 'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
 class Email(db.Model):
     __tablename__ = 'emails'
 
@@ -149,4 +169,15 @@ class PendingTask(db.Model):
     last_error = db.Column(db.Text, nullable=True)
 
     def __repr__(self):
-        return f'<PendingTask {self.id} [{self.task_type}] - {self.status}>' 
\ No newline at end of file
+        return f'<PendingTask {self.id} [{self.task_type}] - {self.status}>'
+
+
+class PollerState(db.Model):
+    __tablename__ = 'poller_state'
+
+    key = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f'<PollerState {self.key}>'
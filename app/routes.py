@@ -1,8 +1,8 @@
 from flask import Blueprint, render_template, current_app, Response, abort, url_for, request, redirect, flash # Added request, redirect, flash
 from flask_login import login_required, current_user
 from sqlalchemy.exc import SQLAlchemyError # Import specific exception
-from sqlalchemy.orm import joinedload, selectinload # Added selectinload
-from sqlalchemy import or_ # Import or_ for search
+from sqlalchemy.orm import joinedload, selectinload, raiseload # Added selectinload, raiseload
+from sqlalchemy import or_, select # Import or_ for search
 from .models import Email, ExtractedData, User, Inquiry, WhatsAppMessage, PendingTask # Added PendingTask model
 from . import db # Import the db object
 import json # Import json for potential type casting
@@ -609,12 +609,18 @@ def update_extracted_data(data_id):
 @login_required
 def inquiry_detail(inquiry_id):
     """Show details for a specific Inquiry, its data, and unified conversation history."""
-    try:
-        # Query for the inquiry, eagerly load extracted data
-        inquiry = Inquiry.query.options(
-            joinedload(Inquiry.extracted_data)
-        ).get_or_404(inquiry_id)
+    # Query for the inquiry, batch-loading extracted data (and its editor, used by the template).
+    # raiseload('*') turns any other lazy load in the template into an error instead of a silent N+1.
+    inquiry = db.session.execute(
+        select(Inquiry).options(
+            selectinload(Inquiry.extracted_data).selectinload(ExtractedData.updated_by_user),
+            raiseload('*')
+        ).where(Inquiry.id == inquiry_id)
+    ).scalar_one_or_none()
+    if inquiry is None:
+        abort(404)
 
+    try:
         # Fetch associated communications
         emails = inquiry.emails.order_by(Email.received_at.asc()).all()
         whatsapp_messages = inquiry.whatsapp_messages.order_by(WhatsAppMessage.received_at.asc()).all()
@@ -4,6 +4,17 @@ from dotenv import load_dotenv
 # Load environment variables from .env file, if it exists
 load_dotenv()
 
+def safe_database_uri(uri):
+    """Return the database URI with credentials removed, for logging."""
+    if not uri:
+        return 'Not Set'
+    scheme, sep, rest = uri.partition('://')
+    # rpartition: an unescaped '@' or '/' in the password still ends up on the left
+    credentials, at, location = rest.rpartition('@')
+    if not sep or not at:
+        return uri # No credentials (e.g. sqlite:///local.db)
+    return f"{scheme}://***@{location}"
+
 class Config:
     """Base configuration class."""
     # Flask settings - Read from SESSION_SECRET env var (REQUIRED)
@@ -14,15 +25,30 @@ class Config:
     # SQLAlchemy settings
     # Silence the deprecation warning
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    # Improve connection handling
-    SQLALCHEMY_ENGINE_OPTIONS = {"pool_pre_ping": True}
+    # Improve connection handling (pool sizing/recycling is filled in by create_app)
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+    # Test each pooled connection with a round trip on checkout; costs one SELECT 1 per request.
+    # Off by default: PostgreSQL connections get TCP keepalives (see create_app) instead.
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'false').lower() == 'true'
+    # Logging level for the root logger (configured in create_app)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    # 'text' (default) or 'json' for structured log ingestion
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    # Run db.create_all() in create_app (otherwise use 'flask db upgrade' / 'flask init-db')
+    AUTO_CREATE_ALL = os.environ.get('AUTO_CREATE_ALL', os.environ.get('RUN_DB_INIT', '0')) == '1'
 
     # Application specific settings (can be overridden)
     # Add any other default config values here
 
     # RQ/Redis Configuration
+    # Lock file that makes only one process per host start APScheduler (default: instance/scheduler.lock)
+    SCHEDULER_LOCK_FILE = os.environ.get('SCHEDULER_LOCK_FILE')
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
     POLL_INTERVAL_SECONDS = int(os.environ.get('POLL_INTERVAL_SECONDS') or 30)
+    # Upper bound for the poll backoff after consecutive empty polls
+    POLL_MAX_INTERVAL_SECONDS = int(os.environ.get('POLL_MAX_INTERVAL_SECONDS') or 600)
+    # A poll task left 'processing' longer than this (e.g. its worker was killed) stops blocking new polls
+    POLL_TASK_STALE_SECONDS = int(os.environ.get('POLL_TASK_STALE_SECONDS') or 900)
 
     # WaAPI Configuration
     WAAPI_API_TOKEN = os.environ.get('WAAPI_API_TOKEN')
@@ -38,10 +64,19 @@ class Config:
     SKIP_ATTACHMENTS_FOR_SPEED = os.environ.get('SKIP_ATTACHMENTS_FOR_SPEED', 'false').lower() == 'true'
     CACHE_EXTRACTION_RESULTS = os.environ.get('CACHE_EXTRACTION_RESULTS', 'true').lower() == 'true'
 
+    # Response compression (Flask-Compress)
+    COMPRESS_MIMETYPES = ['application/json', 'text/csv', 'text/html']
+    COMPRESS_LEVEL = 5
+    COMPRESS_MIN_SIZE = 500
+    COMPRESS_STREAMING = True
+
 class DevelopmentConfig(Config):
     """Development configuration."""
     DEBUG = True
     ENV = 'development' # Deprecated in Flask 2.3, but still useful for clarity
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
+    # Keep the create-tables-on-start devstack flow unless explicitly disabled
+    AUTO_CREATE_ALL = os.environ.get('AUTO_CREATE_ALL', os.environ.get('RUN_DB_INIT', '1')) == '1'
 
     # Database URL (allow fallback to SQLite for easier dev setup)
     DATABASE_URL = os.environ.get('DATABASE_URL')
@@ -119,4 +154,10 @@ config_by_name = dict(
     development=DevelopmentConfig,
     production=ProductionConfig,
     default=DevelopmentConfig
-) 
\ No newline at end of file
+) 
+
+# Resolve the active configuration once, at import time
+_env_name = os.environ.get('FLASK_ENV', 'development')
+if _env_name not in config_by_name:
+    print(f"WARNING: Invalid FLASK_ENV value: '{_env_name}'. Falling back to default (development) configuration.")
+ActiveConfig = config_by_name.get(_env_name, config_by_name['default'])
@@ -3,8 +3,12 @@ import re
 import json
 import logging
 import traceback
+import copy
+import hashlib
+import threading
+from html.parser import HTMLParser
+from cachetools import LRUCache
 from openai import OpenAI, OpenAIError, RateLimitError, APITimeoutError, APIConnectionError
-from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
 
 # Tenacity imports
@@ -24,15 +28,23 @@ retry_openai_call = retry(
 
 # --- OpenAI Client (initialized by configure_openai_client) ---
 openai_client = None
+_openai_api_key = None # Key the current client was built with
 
 # --- Configuration Function (called from app factory) ---
 def configure_openai_client(config):
-    """Initializes the OpenAI client using API key from Flask app config."""
-    global openai_client
+    """Initializes the OpenAI client using API key from Flask app config.
+
+    Idempotent: an existing client built with the same key is reused.
+    """
+    global openai_client, _openai_api_key
     api_key = config.get("OPENAI_API_KEY")
+    if api_key and openai_client is not None and api_key == _openai_api_key:
+        logging.debug("OpenAI client already initialized; reusing it.")
+        return True
     if api_key:
         try:
             openai_client = OpenAI(api_key=api_key)
+            _openai_api_key = api_key
             # Optional: Make a simple test call to ensure the key is valid?
             # E.g., openai_client.models.list() 
             # Be mindful of cost/rate limits if doing this.
@@ -125,14 +137,40 @@ Respond ONLY with the single intent label (e.g., 'inquiry', 'spam', 'solicitatio
         logging.error(f"Failed OpenAI intent classification after retries: {e}", exc_info=False) # Don't need full trace here
         return "unknown" # Return unknown on final failure
 
+class _HTMLTextCollector(HTMLParser):
+    """Collects an HTML document's text nodes as they are parsed, without building a tree."""
+
+    _SKIPPED_TAGS = {'script', 'style', 'template'}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIPPED_TAGS:
+            self._skip_depth += 1
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIPPED_TAGS and self._skip_depth:
+            self._skip_depth -= 1
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.parts.append(data)
+
 def get_text_from_html(html_content):
     """Extracts plain text from HTML content."""
     if not html_content:
         return ""
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
+        # Stream text nodes out of the parser instead of holding a full DOM for large
+        # (often table-heavy) email bodies; script/style/template contents are not text
+        collector = _HTMLTextCollector()
+        collector.feed(html_content)
+        collector.close()
         # Improve text extraction: join lines, remove excessive whitespace
-        lines = (line.strip() for line in soup.get_text().splitlines())
+        lines = (line.strip() for line in ''.join(collector.parts).splitlines())
         chunks = (phrase.strip() for line in lines for phrase in line.split("  "))
         text = '\n'.join(chunk for chunk in chunks if chunk)
         return text
@@ -140,6 +178,39 @@ def get_text_from_html(html_content):
         logging.error(f"Error parsing HTML: {e}")
         return "" # Return empty string on parsing error
 
+# --- Local extraction patterns ---
+# Simplified regex patterns (adjust as needed), compiled once at import time
+# rather than looked up in re's cache on every attempt_local_extraction() call
+email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
+phone_pattern = r'\b(?:\+\d{1,3}[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}\b'
+# More robust date pattern allowing different separators and formats
+date_pattern = r'\b(?:(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*[.,]?\s+\d{1,2}[.,]?\s+\d{4})\b|\b(?:\d{1,2}[-/]\d{1,2}[-/]\d{2,4})\b|\b(?:\d{4}[-/]\d{2}[-/]\d{2})\b'
+cost_pattern = r'\$(?: )?([\d,]+\.?\d{0,2})\b' # Capture the number part
+# Very basic name pattern (likely needs improvement)
+name_pattern = r'\b(?:Mr|Mrs|Ms|Dr)\.?\s+([A-Z][a-z]+(?:-[A-Z][a-z]+)?)\s+([A-Z][a-z]+(?:-[A-Z][a-z]+)?)\b'
+# Basic address pattern (highly variable, difficult with regex)
+address_pattern = r'\b\d+\s+[A-Za-z0-9\s.,]+(?:Street|St|Avenue|Ave|Road|Rd|Lane|Ln)[.,]?\s+[A-Za-z\s]+(?:,)?\s*[A-Z]{2}\s*\d{5}(?:-\d{4})?\b'
+# Basic destination pattern (very limited)
+destination_pattern = r'\b(?:traveling|going|trip)\s+to\s+([A-Z][a-zA-Z\s,]+)\b'
+# Basic deposit date pattern (looks for dates near keywords)
+deposit_date_pattern = r'(?:deposit|paid|booked)(?: on)?[:\s]*(' + date_pattern + r')' # Uses the existing date pattern
+# Basic origin pattern (very unreliable, likely needs OpenAI)
+# Updated to look for US states (abbreviations or names) near keywords
+us_states_pattern = r'(?:Alabama|Alaska|Arizona|Arkansas|California|Colorado|Connecticut|Delaware|Florida|Georgia|Hawaii|Idaho|Illinois|Indiana|Iowa|Kansas|Kentucky|Louisiana|Maine|Maryland|Massachusetts|Michigan|Minnesota|Mississippi|Missouri|Montana|Nebraska|Nevada|New Hampshire|New Jersey|New Mexico|New York|North Carolina|North Dakota|Ohio|Oklahoma|Oregon|Pennsylvania|Rhode Island|South Carolina|South Dakota|Tennessee|Texas|Utah|Vermont|Virginia|Washington|West Virginia|Wisconsin|Wyoming|[A-Z]{2})' # Full names or 2-letter caps
+origin_pattern = r'(?:departing|leaving|coming)\s+from\s+((?:[A-Za-z\s]+,\s*)?' + us_states_pattern + r')' # Optional city/context before state
+
+_EMAIL_RE = re.compile(email_pattern)
+_PHONE_RE = re.compile(phone_pattern)
+_DATE_RE = re.compile(date_pattern, re.IGNORECASE)
+_COST_RE = re.compile(cost_pattern)
+_NAME_RE = re.compile(name_pattern)
+_ADDRESS_RE = re.compile(address_pattern, re.IGNORECASE)
+_DESTINATION_RE = re.compile(destination_pattern, re.IGNORECASE)
+_DEPOSIT_DATE_RE = re.compile(deposit_date_pattern, re.IGNORECASE)
+_ORIGIN_RE = re.compile(origin_pattern, re.IGNORECASE)
+# Currency symbols and thousands separators stripped before parsing trip_cost
+_COST_STRIP_RE = re.compile(r'[$,€£¥]')
+
 def attempt_local_extraction(content):
     """
     Attempt to extract travel-related data using regex patterns.
@@ -161,33 +232,14 @@ def attempt_local_extraction(content):
         "travelers": []
     }
 
-    # Simplified regex patterns (adjust as needed)
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    phone_pattern = r'\b(?:\+\d{1,3}[-.\s]?)?\(?\d{3}\)?[-.\s]?\d{3}[-.\s]?\d{4}\b'
-    # More robust date pattern allowing different separators and formats
-    date_pattern = r'\b(?:(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*[.,]?\s+\d{1,2}[.,]?\s+\d{4})\b|\b(?:\d{1,2}[-/]\d{1,2}[-/]\d{2,4})\b|\b(?:\d{4}[-/]\d{2}[-/]\d{2})\b'
-    cost_pattern = r'\$(?: )?([\d,]+\.?\d{0,2})\b' # Capture the number part
-    # Very basic name pattern (likely needs improvement)
-    name_pattern = r'\b(?:Mr|Mrs|Ms|Dr)\.?\s+([A-Z][a-z]+(?:-[A-Z][a-z]+)?)\s+([A-Z][a-z]+(?:-[A-Z][a-z]+)?)\b'
-    # Basic address pattern (highly variable, difficult with regex)
-    address_pattern = r'\b\d+\s+[A-Za-z0-9\s.,]+(?:Street|St|Avenue|Ave|Road|Rd|Lane|Ln)[.,]?\s+[A-Za-z\s]+(?:,)?\s*[A-Z]{2}\s*\d{5}(?:-\d{4})?\b'
-    # Basic destination pattern (very limited)
-    destination_pattern = r'\b(?:traveling|going|trip)\s+to\s+([A-Z][a-zA-Z\s,]+)\b'
-    # Basic deposit date pattern (looks for dates near keywords)
-    deposit_date_pattern = r'(?:deposit|paid|booked)(?: on)?[:\s]*(' + date_pattern + r')' # Uses the existing date pattern
-    # Basic origin pattern (very unreliable, likely needs OpenAI)
-    # Updated to look for US states (abbreviations or names) near keywords
-    us_states_pattern = r'(?:Alabama|Alaska|Arizona|Arkansas|California|Colorado|Connecticut|Delaware|Florida|Georgia|Hawaii|Idaho|Illinois|Indiana|Iowa|Kansas|Kentucky|Louisiana|Maine|Maryland|Massachusetts|Michigan|Minnesota|Mississippi|Missouri|Montana|Nebraska|Nevada|New Hampshire|New Jersey|New Mexico|New York|North Carolina|North Dakota|Ohio|Oklahoma|Oregon|Pennsylvania|Rhode Island|South Carolina|South Dakota|Tennessee|Texas|Utah|Vermont|Virginia|Washington|West Virginia|Wisconsin|Wyoming|[A-Z]{2})' # Full names or 2-letter caps
-    origin_pattern = r'(?:departing|leaving|coming)\s+from\s+((?:[A-Za-z\s]+,\s*)?' + us_states_pattern + r')' # Optional city/context before state
-
     try:
-        emails = re.findall(email_pattern, content)
+        emails = _EMAIL_RE.findall(content)
         if emails: result["email"] = emails[0]
 
-        phones = re.findall(phone_pattern, content)
+        phones = _PHONE_RE.findall(content)
         if phones: result["phone_number"] = phones[0]
 
-        dates = re.findall(date_pattern, content, re.IGNORECASE)
+        dates = _DATE_RE.findall(content)
         # Basic date assignment logic (needs context for accuracy)
         if len(dates) >= 2:
             result["travel_start_date"] = dates[0]
@@ -199,18 +251,18 @@ def attempt_local_extraction(content):
                  result["date_of_birth"] = dates[0]
 
 
-        costs = re.findall(cost_pattern, content)
+        costs = _COST_RE.findall(content)
         if costs: result["trip_cost"] = f"${costs[0]}" # Add back the dollar sign
 
-        addresses = re.findall(address_pattern, content, re.IGNORECASE)
+        addresses = _ADDRESS_RE.findall(content)
         if addresses: result["home_address"] = addresses[0]
 
         # Attempt to find destination (simple case)
-        destinations = re.findall(destination_pattern, content, re.IGNORECASE)
+        destinations = _DESTINATION_RE.findall(content)
         if destinations: result["trip_destination"] = destinations[0].strip()
 
         # Attempt to find initial deposit date
-        deposit_dates = re.findall(deposit_date_pattern, content, re.IGNORECASE)
+        deposit_dates = _DEPOSIT_DATE_RE.findall(content)
         # Findall captures groups within the pattern, hence deposit_dates might be list of tuples/strings depending on date_pattern structure
         # We need the actual date string captured by the inner date_pattern group
         if deposit_dates:
@@ -220,14 +272,14 @@ def attempt_local_extraction(content):
             result["initial_trip_deposit_date"] = actual_date.strip()
 
         # Attempt to find origin (simple case, focusing on US States)
-        origin_matches = re.search(origin_pattern, content, re.IGNORECASE)
+        origin_matches = _ORIGIN_RE.search(content)
         if origin_matches:
             # group(1) should capture the optional city + state part
             actual_origin = origin_matches.group(1)
             if actual_origin:
                 result["origin"] = actual_origin.strip()
 
-        names = re.findall(name_pattern, content)
+        names = _NAME_RE.findall(content)
         primary_traveler_added = False
         for fname, lname in names:
             result["travelers"].append({
@@ -363,6 +415,11 @@ Return ONLY the JSON object. Do not include explanations or apologies.
         logging.error(f"Failed OpenAI data extraction after retries: {e}", exc_info=False) 
         return None # Return None on final failure
 
+# Recent OpenAI extraction results keyed by a digest of the email text (per process)
+OPENAI_EXTRACTION_CACHE_SIZE = 512
+_openai_extraction_cache = LRUCache(maxsize=OPENAI_EXTRACTION_CACHE_SIZE)
+_openai_extraction_cache_lock = threading.Lock()
+
 def extract_travel_data(email_body_html):
     """
     Orchestrates data extraction: gets text, runs local, runs OpenAI, merges.
@@ -383,13 +440,24 @@ def extract_travel_data(email_body_html):
         logging.error(f"Local extraction failed: {local_e}", exc_info=True)
         # Continue even if local fails
 
-    # 2. OpenAI Extraction
+    # 2. OpenAI Extraction (reused for identical text, e.g. forwards and repeated blasts)
     openai_results = None
-    try:
-        openai_results = extract_data_with_openai(text_content)
-    except Exception as openai_e:
-        logging.error(f"OpenAI extraction call failed: {openai_e}", exc_info=True)
-        # Continue, rely on local results
+    cache_key = hashlib.blake2b(text_content.encode('utf-8'), digest_size=16).digest()
+    with _openai_extraction_cache_lock:
+        cached_results = _openai_extraction_cache.get(cache_key)
+    if isinstance(cached_results, dict):
+        logging.info("Reusing OpenAI extraction for identical email text.")
+        openai_results = copy.deepcopy(cached_results)
+    else:
+        try:
+            openai_results = extract_data_with_openai(text_content)
+        except Exception as openai_e:
+            logging.error(f"OpenAI extraction call failed: {openai_e}", exc_info=True)
+            # Continue, rely on local results
+        if openai_results:
+            # Only successful extractions are cached so a transient failure is retried next time
+            with _openai_extraction_cache_lock:
+                _openai_extraction_cache[cache_key] = copy.deepcopy(openai_results)
 
     # 3. Merge Results (Prefer OpenAI for non-null values)
     final_data = local_results.copy()
@@ -466,8 +534,7 @@ def extract_travel_data(email_body_html):
             # Attempt to clean and convert cost to float
             cost_str = str(raw_cost).strip()
             # Remove common currency symbols and commas
-            cost_str = re.sub(r'[$,€£¥]', '', cost_str)
-            cost_str = cost_str.replace(',', '')
+            cost_str = _COST_STRIP_RE.sub('', cost_str)
             cost_numeric = float(cost_str)
             cost_per_traveler = round(cost_numeric / num_travelers, 2)
             logging.info(f"Calculated cost per traveler: {cost_per_traveler} ({cost_numeric} / {num_travelers})")
@@ -0,0 +1,37 @@
+"""Add composite and trigram indexes for inquiry dashboards
+
+Revision ID: 7c3d2a91e4f0
+Revises: 5f7a8b9c4d2e
+Create Date: 2026-10-16 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c3d2a91e4f0'
+down_revision = '5f7a8b9c4d2e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_inquiries_status_updated_at', 'inquiries', ['status', 'updated_at'], unique=False)
+    op.create_index('ix_inquiries_updated_at_created_at', 'inquiries', ['updated_at', 'created_at'], unique=False)
+
+    # Substring search (ILIKE '%term%') can only use a trigram GIN index (PostgreSQL only)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.create_index(
+            'ix_inquiries_primary_email_address_trgm', 'inquiries', ['primary_email_address'],
+            unique=False, postgresql_using='gin',
+            postgresql_ops={'primary_email_address': 'gin_trgm_ops'}
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_inquiries_primary_email_address_trgm', table_name='inquiries')
+    op.drop_index('ix_inquiries_updated_at_created_at', table_name='inquiries')
+    op.drop_index('ix_inquiries_status_updated_at', table_name='inquiries')
@@ -0,0 +1,28 @@
+"""Add partial indexes for common inquiry statuses
+
+Revision ID: 8d4e1f2a6b7c
+Revises: 7c3d2a91e4f0
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4e1f2a6b7c'
+down_revision = '7c3d2a91e4f0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_inquiries_incomplete_updated_at', 'inquiries', ['updated_at'], unique=False,
+                    postgresql_where=sa.text("status = 'Incomplete'"))
+    op.create_index('ix_inquiries_error_updated_at', 'inquiries', ['updated_at'], unique=False,
+                    postgresql_where=sa.text("status = 'Error'"))
+
+
+def downgrade():
+    op.drop_index('ix_inquiries_error_updated_at', table_name='inquiries')
+    op.drop_index('ix_inquiries_incomplete_updated_at', table_name='inquiries')
@@ -0,0 +1,29 @@
+"""Add poller_state table for the Graph delta link
+
+Revision ID: 9e5f2b3c7d8a
+Revises: 8d4e1f2a6b7c
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e5f2b3c7d8a'
+down_revision = '8d4e1f2a6b7c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'poller_state',
+        sa.Column('key', sa.String(length=100), primary_key=True),
+        sa.Column('value', sa.Text(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True, server_default=sa.func.now())
+    )
+
+
+def downgrade():
+    op.drop_table('poller_state')
@@ -3,12 +3,16 @@ import time
 import logging
 import traceback
 import base64
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 
 import msal
 import requests
+from requests.adapters import HTTPAdapter
 
 # Tenacity imports for retrying
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception
 from requests.exceptions import RequestException, HTTPError
 
 # Configure logging
@@ -25,16 +29,45 @@ def is_transient_error(exception):
         # 502: Bad Gateway
         # 503: Service Unavailable
         # 504: Gateway Timeout
-        return exception.response.status_code in [429, 500, 502, 503, 504]
+        return exception.response is not None and exception.response.status_code in [429, 500, 502, 503, 504]
     # Retry on general connection errors, timeouts, etc.
     return isinstance(exception, RequestException)
 
+# Longest we honour a Retry-After header for before trying again
+MAX_RETRY_AFTER_SECONDS = 120
+
+def _retry_after_seconds(exception):
+    """Seconds from a throttled response's Retry-After header (delta-seconds or HTTP-date), else None."""
+    response = getattr(exception, 'response', None)
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), MAX_RETRY_AFTER_SECONDS)
+
+_exponential_backoff = wait_exponential(multiplier=1, min=1, max=60)
+
+def _wait_for_graph_retry(retry_state):
+    """Wait what Graph asks for on 429/503 (Retry-After); otherwise exponential backoff with jitter."""
+    retry_after = _retry_after_seconds(retry_state.outcome.exception())
+    if retry_after is not None:
+        return retry_after
+    return _exponential_backoff(retry_state) + random.uniform(0, 1)
+
 # Decorator for retrying Graph API calls
-# Waits 2^x * 1 second between each retry, starting with 1 second, up to 30 seconds, for 5 attempts.
+# Only transient failures (429, 5xx, connection errors) are retried, for 5 attempts; permanent
+# 4xx errors such as 404 fail immediately instead of burning the retry budget.
 retry_graph_call = retry(
     stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=1, max=30),
-    retry=retry_if_exception_type((RequestException, HTTPError)) # Simplified check, could use is_transient_error for more specific codes
+    wait=_wait_for_graph_retry,
+    retry=retry_if_exception(is_transient_error),
+    reraise=True # Callers see the HTTPError itself, not tenacity's RetryError
 )
 
 # --- Module Level Configuration Store ---
@@ -47,16 +80,31 @@ _ms365_token_cache = {
     "expires_at": 0
 }
 
+# MSAL application, built once per configuration and reused for token requests
+_msal_app = None
+
 # --- Configuration Function (called from app factory) ---
 def configure_ms_graph_client(config):
-    """Loads MS Graph configuration from the Flask app config object."""
-    global _graph_config
-    _graph_config = {
+    """Loads MS Graph configuration from the Flask app config object.
+
+    Idempotent: calling it again with the same settings keeps the existing
+    MSAL app and cached token.
+    """
+    global _graph_config, _msal_app
+    new_config = {
         "client_id": config.get("MS_GRAPH_CLIENT_ID"),
         "client_secret": config.get("MS_GRAPH_CLIENT_SECRET"),
         "tenant_id": config.get("MS_GRAPH_TENANT_ID"),
         "mailbox_user_id": config.get("MS_GRAPH_MAILBOX_USER_ID") # Mailbox to monitor
     }
+    if _graph_config and new_config == _graph_config:
+        logging.debug("MS Graph client configuration unchanged; reusing existing client.")
+        return True
+    # Settings changed: drop anything built from the previous configuration
+    _graph_config = new_config
+    _msal_app = None
+    _ms365_token_cache["token"] = None
+    _ms365_token_cache["expires_at"] = 0
     missing = [key for key, value in _graph_config.items() if not value]
     if missing:
         logging.error(f"MS Graph configuration incomplete. Missing keys: {', '.join(missing)}")
@@ -76,7 +124,7 @@ def _ensure_config_loaded():
 
 def get_access_token():
     """Gets a Graph API access token using client credentials, caching it."""
-    global _ms365_token_cache
+    global _ms365_token_cache, _msal_app
 
     # Check if config is loaded first
     _ensure_config_loaded()
@@ -89,15 +137,17 @@ def get_access_token():
     logging.info("Attempting to get new MS Graph token...")
     try:
         # Access config from module-level variable
-        authority = f"https://login.microsoftonline.com/{_graph_config['tenant_id']}"
-        app = msal.ConfidentialClientApplication(
-            _graph_config['client_id'],
-            authority=authority,
-            client_credential=_graph_config['client_secret']
-        )
+        if _msal_app is None:
+            authority = f"https://login.microsoftonline.com/{_graph_config['tenant_id']}"
+            # Building the app performs authority discovery, so do it once and reuse it
+            _msal_app = msal.ConfidentialClientApplication(
+                _graph_config['client_id'],
+                authority=authority,
+                client_credential=_graph_config['client_secret']
+            )
 
         logging.info("Requesting token with client credentials...")
-        result = app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
+        result = _msal_app.acquire_token_for_client(scopes=["https://graph.microsoft.com/.default"])
 
         if "access_token" in result:
             logging.info("New MS Graph token acquired successfully.")
@@ -118,9 +168,17 @@ def get_access_token():
         logging.debug(traceback.format_exc()) # Log stack trace for debugging
         raise
 
+# One pooled HTTP session for all Graph calls so polls reuse TLS connections instead of
+# handshaking per request. Outlook runs at most 4 requests concurrently per mailbox, so
+# keeping more connections open to graph.microsoft.com would not help.
+GRAPH_MAX_CONNECTIONS = 4
+GRAPH_REQUEST_TIMEOUT = (10, 60) # (connect, read) seconds; timeouts are retried as transient
+_graph_http_session = requests.Session()
+_graph_http_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=GRAPH_MAX_CONNECTIONS))
+
 # Apply retry logic ONLY to the function making the actual network call
 @retry_graph_call
-def _make_graph_api_call(method, endpoint, params=None, json_data=None):
+def _make_graph_api_call(method, endpoint, params=None, json_data=None, extra_headers=None):
     """Helper function to make authenticated calls to the Graph API with retry logic."""
     # Check if config is loaded (implicitly checked by get_access_token)
     try:
@@ -129,8 +187,11 @@ def _make_graph_api_call(method, endpoint, params=None, json_data=None):
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json'
         }
+        if extra_headers:
+            headers.update(extra_headers)
         logging.debug(f"Making Graph API call: {method} {endpoint} with params: {params}")
-        response = requests.request(method, endpoint, headers=headers, params=params, json=json_data)
+        response = _graph_http_session.request(method, endpoint, headers=headers, params=params, json=json_data,
+                                               timeout=GRAPH_REQUEST_TIMEOUT)
         
         # Log attempt details (useful for retry debugging)
         attempt_number = _make_graph_api_call.retry.statistics.get('attempt_number', 1)
@@ -180,8 +241,14 @@ def fetch_emails(max_emails=20):
         logging.error(f"Failed to fetch emails: {e}")
         return [] # Return empty list on error
 
-def fetch_email_details(email_id):
-    """Fetches full details for a specific email, including the body."""
+# $select lists for the polling pipeline: only what classification and extraction read,
+# since full message resources are several times larger
+DELTA_SUMMARY_FIELDS = 'id,subject,receivedDateTime,bodyPreview,hasAttachments'
+PROCESSING_DETAIL_FIELDS = 'id,body,from'
+EMAIL_DETAIL_FIELDS = 'id,subject,from,toRecipients,receivedDateTime,body,hasAttachments'
+
+def fetch_email_details(email_id, fields=EMAIL_DETAIL_FIELDS):
+    """Fetches full details for a specific email, including the body (limited to `fields`)."""
     logging.info(f"Fetching details for email ID: {email_id}")
     try:
         _ensure_config_loaded()
@@ -192,7 +259,7 @@ def fetch_email_details(email_id):
         endpoint = f"https://graph.microsoft.com/v1.0/users/{target_user}/messages/{email_id}"
         params = {
             # Request body in HTML format
-            '$select': 'id,subject,from,toRecipients,receivedDateTime,body,hasAttachments'
+            '$select': fields
         }
         email_data = _make_graph_api_call("GET", endpoint, params=params)
         logging.info(f"Successfully fetched details for email ID: {email_id}")
@@ -258,6 +325,72 @@ def fetch_new_emails_since(timestamp):
         logging.debug(traceback.format_exc()) # Add traceback for better error diagnosis
         return []  # Return empty list on error
 
+# Delta pages default to 10 messages; ask for larger pages via the Prefer header
+DELTA_PAGE_SIZE = 50
+
+def fetch_email_delta(delta_link=None, since=None):
+    """Fetches inbox messages added or changed since the last delta sync, handling pagination.
+
+    With no delta_link an initial sync is started (limited to messages received
+    at or after `since`, when given); `since` bounds the fresh sync started when a
+    stored delta_link has expired (410 Gone) in the same way. Returns (emails, next_delta_link). Errors are
+    logged and re-raised rather than reported as an empty result, so callers can tell
+    a failed sync from a quiet mailbox and keep their stored delta link.
+    """
+    try:
+        _ensure_config_loaded()
+        target_user = _graph_config.get('mailbox_user_id')
+        if not target_user:
+            raise RuntimeError("Mailbox user ID not configured.")
+
+        if delta_link:
+            logging.info("Polling for mailbox changes with stored delta link.")
+            current_endpoint_url, current_params = delta_link, None
+        else:
+            logging.info(f"Starting inbox delta sync{f' from {since.isoformat()}' if since else ''}.")
+            current_endpoint_url = f"https://graph.microsoft.com/v1.0/users/{target_user}/mailFolders/inbox/messages/delta"
+            current_params = {'$select': DELTA_SUMMARY_FIELDS}
+            if since:
+                current_params['$filter'] = f"receivedDateTime ge {since.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+
+        all_new_emails = []
+        next_delta_link = None
+        page_num = 1
+        while current_endpoint_url:
+            try:
+                data = _make_graph_api_call("GET", current_endpoint_url, params=current_params,
+                                            extra_headers={'Prefer': f'odata.maxpagesize={DELTA_PAGE_SIZE}'})
+            except HTTPError as http_err:
+                # 410 Gone: the sync state behind the delta link expired; start a fresh sync
+                if delta_link and http_err.response is not None and http_err.response.status_code == 410:
+                    logging.warning("Stored delta link has expired; restarting delta sync.")
+                    return fetch_email_delta(None, since)
+                raise
+            data = data or {}
+            # Deleted/moved-out messages come back as {"id": ..., "@removed": {...}}
+            page_emails = [item for item in data.get("value", []) if "@removed" not in item]
+            all_new_emails.extend(page_emails)
+            logging.debug(f"Delta page {page_num} returned {len(page_emails)} message(s).")
+
+            # nextLink/deltaLink contain all necessary query parameters
+            current_endpoint_url, current_params = data.get("@odata.nextLink"), None
+            next_delta_link = data.get("@odata.deltaLink", next_delta_link)
+            page_num += 1
+
+        if not next_delta_link:
+            raise RuntimeError("Delta sync finished without returning a delta link.")
+
+        all_new_emails.sort(key=lambda email: email.get('receivedDateTime') or '') # Process oldest first
+        if all_new_emails:
+            logging.info(f"Found a total of {len(all_new_emails)} new or changed email(s) since last sync.")
+        else:
+            logging.debug("No mailbox changes since last sync.")
+        return all_new_emails, next_delta_link
+    except Exception as e:
+        logging.error(f"Error polling mailbox delta: {e}")
+        logging.debug(traceback.format_exc())
+        raise
+
 def fetch_attachments_list(email_id):
     """Fetches the list of attachments for a specific email."""
     logging.info(f"Fetching attachment list for email ID: {email_id}")
@@ -279,6 +412,91 @@ def fetch_attachments_list(email_id):
         logging.error(f"Failed to fetch attachments list for {email_id}: {e}")
         return []
 
+# JSON batching: Graph accepts up to 20 sub-requests per $batch, but Outlook mailbox
+# resources only run 4 requests concurrently per mailbox; independent extra sub-requests
+# come back as throttled (429). Each batch is therefore split into 4 dependsOn chains,
+# so a full batch of 20 runs at most 4 at a time.
+GRAPH_BATCH_ENDPOINT = "https://graph.microsoft.com/v1.0/$batch"
+GRAPH_BATCH_MAX_REQUESTS = 20
+GRAPH_BATCH_CONCURRENT_REQUESTS = 4
+
+def _chain_batch_requests(sub_requests, lanes=GRAPH_BATCH_CONCURRENT_REQUESTS):
+    """Copy sub_requests with dependsOn links so at most `lanes` of them run concurrently.
+
+    Graph fails the rest of a chain with 424 when a request in it fails; callers treat
+    that like any other failed sub-request.
+    """
+    chained = []
+    for index, sub_request in enumerate(sub_requests):
+        sub_request = dict(sub_request)
+        if index >= lanes:
+            sub_request["dependsOn"] = [sub_requests[index - lanes]["id"]]
+        chained.append(sub_request)
+    return chained
+
+def fetch_details_and_attachments_batch(email_ids, include_attachments=True, attachment_email_ids=None):
+    """Fetches full details (and attachment metadata) for several emails via JSON $batch.
+
+    Attachment lists are requested for every email, or only for those in
+    attachment_email_ids when given (e.g. the ones whose summary has hasAttachments).
+    Returns a dict of email_id -> (details, attachments). Either value is None when
+    its sub-request failed (e.g. throttled) or was not requested, so callers can fall
+    back to fetch_email_details / fetch_attachments_list for that email.
+    """
+    results = {email_id: (None, None) for email_id in email_ids}
+    if not email_ids:
+        return results
+    try:
+        _ensure_config_loaded()
+        target_user = _graph_config.get('mailbox_user_id')
+        if not target_user:
+            raise RuntimeError("Mailbox user ID not configured.")
+
+        sub_requests = []
+        request_targets = {} # sub-request id -> (kind, email_id); Graph ids are too long to reuse
+        for index, email_id in enumerate(email_ids):
+            # Same $select lists as the worker's single-email fallbacks
+            sub_requests.append({
+                "id": f"d{index}", "method": "GET",
+                "url": f"/users/{target_user}/messages/{email_id}?$select={PROCESSING_DETAIL_FIELDS}",
+            })
+            request_targets[f"d{index}"] = ("details", email_id)
+            if include_attachments and (attachment_email_ids is None or email_id in attachment_email_ids):
+                sub_requests.append({
+                    "id": f"a{index}", "method": "GET",
+                    "url": f"/users/{target_user}/messages/{email_id}/attachments?$select=id,name,contentType,size",
+                })
+                request_targets[f"a{index}"] = ("attachments", email_id)
+
+        details, attachments = {}, {}
+        for start in range(0, len(sub_requests), GRAPH_BATCH_MAX_REQUESTS):
+            chunk = _chain_batch_requests(sub_requests[start:start + GRAPH_BATCH_MAX_REQUESTS])
+            try:
+                data = _make_graph_api_call("POST", GRAPH_BATCH_ENDPOINT, json_data={"requests": chunk})
+            except Exception as e:
+                logging.warning(f"Graph $batch request failed; affected emails will be fetched individually: {e}")
+                continue
+            for response in (data or {}).get("responses", []):
+                target = request_targets.get(response.get("id"))
+                if target is None:
+                    continue
+                if response.get("status") != 200:
+                    logging.warning(f"Graph $batch sub-request {response.get('id')} returned status {response.get('status')}.")
+                    continue
+                kind, email_id = target
+                body = response.get("body") or {}
+                if kind == "details":
+                    details[email_id] = body
+                else:
+                    attachments[email_id] = body.get("value", [])
+
+        for email_id in email_ids:
+            results[email_id] = (details.get(email_id), attachments.get(email_id))
+        logging.info(f"Fetched details for {len(details)}/{len(email_ids)} email(s) via $batch.")
+    except Exception as e:
+        logging.error(f"Failed to batch-fetch email details: {e}")
+    return results
+
 def fetch_attachment_content(email_id, attachment_id):
     """Fetches the content of a specific attachment."""
     logging.info(f"Fetching content for attachment ID: {attachment_id} from email: {email_id}")
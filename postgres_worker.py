@@ -138,6 +138,8 @@ def process_pending_tasks(app, db_session_factory):
         finally:
             if db_sess:
                 db_session_factory.remove() # Properly close/remove the scoped session
+            # Handlers reuse the worker's app context, so release their Flask-SQLAlchemy session here
+            flask_db.session.remove()
 
         # If no task was processed, or after processing one, sleep.
         if not result: # Only sleep if no task was found to process immediately
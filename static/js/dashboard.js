@@ -1,4 +1,7 @@
 document.addEventListener('DOMContentLoaded', function() {
+    // Keyset cursor returned by the server for the page after the current one
+    let nextCursor = null;
+
     // Initialize DataTable
     const table = $('#inquiriesTable').DataTable({
         processing: true,
@@ -7,6 +10,15 @@ document.addEventListener('DOMContentLoaded', function() {
             url: '/api/inquiries',
             data: function(d) {
                 d.status_filter = $('#statusFilter').val();
+                // Send the cursor only when paging forward to the page it describes
+                if (nextCursor && nextCursor.start === d.start) {
+                    d.last_id = nextCursor.last_id;
+                    d.last_sort_value = nextCursor.last_sort_value;
+                }
+            },
+            dataSrc: function(json) {
+                nextCursor = json.next_cursor || null;
+                return json.data;
             }
         },
         columns: [
@@ -33,9 +45,15 @@ document.addEventListener('DOMContentLoaded', function() {
                 }
             },
             { 
-                data: 'actions',
+                data: 'id',
                 orderable: false,
-                searchable: false
+                searchable: false,
+                render: function(data, type, row) {
+                    if (type === 'display') {
+                        return `<a href="/inquiry/${data}" class="btn btn-sm btn-info">View/Edit</a>`;
+                    }
+                    return data;
+                }
             }
         ],
         order: [[1, 'desc']],  // Default order by Date Received (newest first)
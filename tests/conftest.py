@@ -0,0 +1,31 @@
+import pytest
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@pytest.fixture
+def assert_max_queries():
+    """Fail the test if the wrapped block issues more than `n` SQL statements.
+
+    Usage:
+        with assert_max_queries(2) as queries:
+            client.get('/inquiry/1')
+    """
+    @contextmanager
+    def _assert_max_queries(n):
+        queries = []
+
+        def _record_query(conn, cursor, statement, parameters, context, executemany):
+            queries.append(statement)
+
+        event.listen(Engine, "before_cursor_execute", _record_query)
+        try:
+            yield queries
+        finally:
+            event.remove(Engine, "before_cursor_execute", _record_query)
+        assert len(queries) <= n, (
+            f"Expected at most {n} queries, got {len(queries)}:\n" + "\n".join(queries)
+        )
+
+    return _assert_max_queries
@@ -15,7 +15,11 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from ms_graph_service import fetch_new_emails_since, configure_ms_graph_client, _graph_config
+from ms_graph_service import (
+    fetch_new_emails_since, fetch_email_delta, fetch_details_and_attachments_batch, configure_ms_graph_client, _graph_config,
+    GRAPH_BATCH_MAX_REQUESTS, GRAPH_BATCH_CONCURRENT_REQUESTS, is_transient_error, _retry_after_seconds, MAX_RETRY_AFTER_SECONDS
+)
+from requests.exceptions import HTTPError
 
 # Sample config for testing
 TEST_CONFIG = {
@@ -169,5 +173,162 @@ class TestFetchNewEmailsSince(unittest.TestCase):
         self.assertEqual(mock_make_call.call_count, 2)
 
 
+class TestFetchEmailDelta(unittest.TestCase):
+
+    def setUp(self):
+        self.original_graph_config = copy.deepcopy(_graph_config)
+        configure_ms_graph_client(MagicMock(**TEST_CONFIG))
+
+    @patch('ms_graph_service._make_graph_api_call')
+    def test_initial_sync_follows_next_links_until_delta_link(self, mock_make_call):
+        """An initial sync pages through nextLinks, drops removed items and returns the deltaLink."""
+        mock_make_call.side_effect = [
+            {
+                "value": [create_email_summary("email2", "2023-01-01T10:05:00Z"), {"id": "gone", "@removed": {"reason": "deleted"}}],
+                "@odata.nextLink": "https://graph.microsoft.com/v1.0/next_page"
+            },
+            {
+                "value": [create_email_summary("email1", "2023-01-01T10:00:00Z")],
+                "@odata.deltaLink": "https://graph.microsoft.com/v1.0/delta_token"
+            }
+        ]
+
+        since = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        emails, delta_link = fetch_email_delta(None, since=since)
+
+        self.assertEqual([email["id"] for email in emails], ["email1", "email2"]) # Oldest first
+        self.assertEqual(delta_link, "https://graph.microsoft.com/v1.0/delta_token")
+        first_call_args = mock_make_call.call_args_list[0]
+        self.assertTrue(first_call_args[0][1].endswith("/mailFolders/inbox/messages/delta"))
+        self.assertEqual(first_call_args[1]['params']['$filter'], "receivedDateTime ge 2023-01-01T00:00:00Z")
+        self.assertEqual(mock_make_call.call_args_list[1][0][1], "https://graph.microsoft.com/v1.0/next_page")
+        self.assertIsNone(mock_make_call.call_args_list[1][1]['params'])
+
+    @patch('ms_graph_service._make_graph_api_call')
+    def test_stored_delta_link_is_used_directly(self, mock_make_call):
+        mock_make_call.return_value = {"value": [], "@odata.deltaLink": "new_delta"}
+
+        emails, delta_link = fetch_email_delta("old_delta")
+
+        self.assertEqual(emails, [])
+        self.assertEqual(delta_link, "new_delta")
+        mock_make_call.assert_called_once()
+        self.assertEqual(mock_make_call.call_args[0][1], "old_delta")
+
+    @patch('ms_graph_service._make_graph_api_call')
+    def test_failure_is_raised_not_reported_as_empty(self, mock_make_call):
+        """A failed sync must not look like a quiet mailbox to the poller."""
+        mock_make_call.side_effect = Exception("Simulated API Error")
+
+        with self.assertLogs(level='ERROR'), self.assertRaises(Exception):
+            fetch_email_delta("old_delta")
+
+    @patch('ms_graph_service._make_graph_api_call')
+    def test_expired_delta_link_restarts_sync(self, mock_make_call):
+        gone = HTTPError(response=MagicMock(status_code=410))
+        mock_make_call.side_effect = [gone, {"value": [], "@odata.deltaLink": "fresh_delta"}]
+
+        since = datetime(2023, 1, 1, tzinfo=timezone.utc)
+        emails, delta_link = fetch_email_delta("expired_delta", since=since)
+
+        self.assertEqual(delta_link, "fresh_delta")
+        restart_call = mock_make_call.call_args_list[1]
+        self.assertTrue(restart_call[0][1].endswith("/mailFolders/inbox/messages/delta"))
+        # The restarted sync keeps the catch-up window instead of resyncing the whole inbox
+        self.assertEqual(restart_call[1]['params']['$filter'], "receivedDateTime ge 2023-01-01T00:00:00Z")
+
+
+class TestFetchDetailsAndAttachmentsBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.original_graph_config = copy.deepcopy(_graph_config)
+        configure_ms_graph_client(MagicMock(**TEST_CONFIG))
+
+    def tearDown(self):
+        global _graph_config
+        _graph_config = self.original_graph_config
+
+    @patch('ms_graph_service._make_graph_api_call')
+    def test_batches_details_and_attachments(self, mock_make_call):
+        """Each email needs two sub-requests; they are sent in chunks and mapped back by email id."""
+        def batch_response(method, endpoint, params=None, json_data=None):
+            responses = []
+            for sub in json_data["requests"]:
+                if sub["id"].startswith("d"):
+                    body = {"id": sub["url"].split("/messages/")[1].split("?")[0], "body": {"content": "<p>hi</p>"}}
+                else:
+                    body = {"value": [{"id": "att1", "name": "a.pdf"}]}
+                responses.append({"id": sub["id"], "status": 200, "body": body})
+            return {"responses": responses}
+        mock_make_call.side_effect = batch_response
+
+        results = fetch_details_and_attachments_batch(["email1", "email2", "email3"])
+
+        self.assertEqual(mock_make_call.call_count, -(-6 // GRAPH_BATCH_MAX_REQUESTS))
+        for call in mock_make_call.call_args_list:
+            self.assertEqual(call[0][0], "POST")
+            self.assertLessEqual(len(call[1]["json_data"]["requests"]), GRAPH_BATCH_MAX_REQUESTS)
+        self.assertEqual(results["email2"][0]["id"], "email2")
+        self.assertEqual(results["email3"][1], [{"id": "att1", "name": "a.pdf"}])
+
+    @patch('ms_graph_service._make_graph_api_call')
+    def test_failed_sub_request_is_left_for_fallback(self, mock_make_call):
+        """A throttled sub-request yields None so the caller fetches that email individually."""
+        mock_make_call.return_value = {"responses": [
+            {"id": "d0", "status": 429, "body": {"error": {"code": "TooManyRequests"}}},
+            {"id": "a0", "status": 200, "body": {"value": []}},
+        ]}
+
+        results = fetch_details_and_attachments_batch(["email1"])
+
+        self.assertEqual(results["email1"], (None, []))
+
+    @patch('ms_graph_service._make_graph_api_call')
+    def test_sub_requests_are_chained_to_mailbox_concurrency(self, mock_make_call):
+        """Beyond GRAPH_BATCH_CONCURRENT_REQUESTS, each sub-request depends on the one a lane earlier."""
+        mock_make_call.return_value = {"responses": []}
+
+        fetch_details_and_attachments_batch([f"email{i}" for i in range(5)])
+
+        requests_sent = mock_make_call.call_args_list[0][1]["json_data"]["requests"]
+        lanes = GRAPH_BATCH_CONCURRENT_REQUESTS
+        self.assertTrue(all("dependsOn" not in sub for sub in requests_sent[:lanes]))
+        for index in range(lanes, len(requests_sent)):
+            self.assertEqual(requests_sent[index]["dependsOn"], [requests_sent[index - lanes]["id"]])
+
+    @patch('ms_graph_service._make_graph_api_call')
+    def test_attachments_only_requested_for_listed_emails(self, mock_make_call):
+        """Emails outside attachment_email_ids (hasAttachments false) get no attachments sub-request."""
+        mock_make_call.return_value = {"responses": []}
+
+        fetch_details_and_attachments_batch(["email1", "email2"], attachment_email_ids={"email2"})
+
+        sub_ids = [sub["id"] for call in mock_make_call.call_args_list for sub in call[1]["json_data"]["requests"]]
+        self.assertEqual(sorted(sub_ids), ["a1", "d0", "d1"])
+
+
+def make_http_error(status_code, headers=None):
+    response = MagicMock(status_code=status_code, headers=headers or {})
+    return HTTPError(response=response)
+
+class TestGraphRetryPolicy(unittest.TestCase):
+
+    def test_only_throttling_and_server_errors_are_transient(self):
+        self.assertTrue(is_transient_error(make_http_error(429)))
+        self.assertTrue(is_transient_error(make_http_error(503)))
+        self.assertFalse(is_transient_error(make_http_error(404)))
+        self.assertFalse(is_transient_error(make_http_error(403)))
+
+    def test_retry_after_seconds_is_honoured_and_capped(self):
+        self.assertEqual(_retry_after_seconds(make_http_error(429, {'Retry-After': '7'})), 7)
+        self.assertEqual(_retry_after_seconds(make_http_error(429, {'Retry-After': '3600'})), MAX_RETRY_AFTER_SECONDS)
+        self.assertIsNone(_retry_after_seconds(make_http_error(500)))
+
+    def test_retry_after_http_date(self):
+        retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+        header = retry_at.strftime('%a, %d %b %Y %H:%M:%S GMT')
+        self.assertAlmostEqual(_retry_after_seconds(make_http_error(503, {'Retry-After': header})), 30, delta=2)
+
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,113 @@
+import pytest
+from datetime import datetime, timezone
+from sqlalchemy import create_engine, text
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine('sqlite:///:memory:')
+    yield engine
+    engine.dispose()
+
+
+def test_assert_max_queries_within_budget(engine, assert_max_queries):
+    with assert_max_queries(2) as queries:
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+            conn.execute(text('SELECT 2'))
+    assert len(queries) == 2
+
+
+def test_assert_max_queries_fails_over_budget(engine, assert_max_queries):
+    with pytest.raises(AssertionError, match='Expected at most 1 queries, got 2'):
+        with assert_max_queries(1):
+            with engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+                conn.execute(text('SELECT 2'))
+
+
+# --- Route budgets ---
+# These run the real app factory on in-memory SQLite so an N+1 in a view fails the test
+
+@pytest.fixture
+def app():
+    from config import Config
+    from app import create_app
+    from app.extensions import db
+
+    class TestConfig(Config):
+        TESTING = True
+        DATABASE_URL = 'sqlite:///:memory:'
+        AUTO_CREATE_ALL = False
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def logged_in_client(app):
+    from app.extensions import db
+    from app.models import User
+
+    user = User(username='budget', email='budget@example.com', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+    return client
+
+
+def test_inquiry_detail_query_budget(app, logged_in_client, assert_max_queries):
+    from app.extensions import db
+    from app.models import Inquiry, Email, ExtractedData, User, WhatsAppMessage
+
+    editor = db.session.scalars(db.select(User)).one()
+    inquiry = Inquiry(primary_email_address='client@example.com', status='Incomplete',
+                      updated_at=datetime(2024, 5, 2, tzinfo=timezone.utc))
+    db.session.add(inquiry)
+    db.session.flush()
+    db.session.add(ExtractedData(inquiry_id=inquiry.id, data={'first_name': 'Ada'},
+                                  updated_by_user_id=editor.id, updated_at=datetime(2024, 5, 2, tzinfo=timezone.utc)))
+    for i in range(5):
+        db.session.add(Email(graph_id=f'email-{i}', subject=f'Subject {i}', inquiry_id=inquiry.id,
+                             received_at=datetime(2024, 5, 1, 9, i, tzinfo=timezone.utc)))
+        db.session.add(WhatsAppMessage(id=f'wa-{i}', inquiry_id=inquiry.id, wa_chat_id='15550001111@c.us',
+                                       message_type='textMessage', body=f'Message {i}',
+                                       sender_number='15550001111', from_me=False,
+                                       received_at=datetime(2024, 5, 1, 10, i, tzinfo=timezone.utc)))
+    db.session.commit()
+    inquiry_id = inquiry.id
+    db.session.remove()
+
+    # User, inquiry, extracted data (+ editor), emails and WhatsApp messages: a fixed
+    # number of queries however many messages the inquiry has
+    with assert_max_queries(6):
+        response = logged_in_client.get(f'/inquiry/{inquiry_id}')
+    assert response.status_code == 200
+
+
+def test_cached_user_load_issues_no_query(app, logged_in_client, assert_max_queries):
+    from app import _user_cache
+    from app.extensions import db, login_manager
+    from app.models import User
+
+    _user_cache.clear()
+    user_id = str(db.session.scalars(db.select(User.id)).one())
+    with app.test_request_context():
+        first = login_manager._user_callback(user_id)
+        # A commit in the loading request expires its instance; the cache must not care
+        db.session.commit()
+    db.session.remove()
+
+    with app.test_request_context():
+        with assert_max_queries(0):
+            user = login_manager._user_callback(user_id)
+            assert user.username == 'budget'
+        assert user is not first
+        assert user in db.session
+    db.session.remove()
@@ -6,215 +6,314 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-# Assuming Flask app and other necessary modules are importable
-# This setup can be complex depending on the Flask app structure (app factory, etc.)
-# For this example, we'll mock heavily and assume `app` can be imported or constructed.
-
-# Attempt to import necessary components
-# These imports might need significant adjustment based on actual project structure
-# and how the Flask app context is managed in tests.
-try:
-    from app.background_tasks import poll_new_emails, get_email_queue # For patching get_email_queue
-    from web_app import app as flask_app # Assuming your Flask app instance is here
-except ImportError as e:
-    print(f"Test setup ImportError: {e}. You might need to adjust PYTHONPATH or test structure.")
-    # Define placeholders if imports fail, so the file can be parsed
-    flask_app = MagicMock()
-    def poll_new_emails(app_param):
-        pass
-    def get_email_queue():
-        return MagicMock()
-
-# Helper to create email summaries for testing
+from flask import Flask
+from requests.exceptions import HTTPError
+
+from app.background_tasks import (
+    poll_new_emails, trigger_email_polling_task_creation, _next_poll_interval,
+    _insert_ignoring_duplicates, _upsert_poller_state,
+    INBOX_DELTA_LINK_KEY, EMPTY_POLLS_KEY, POLL_BACKOFF_UNTIL_KEY
+)
+from app.models import db, AttachmentMetadata, Email, PendingTask, PollerState
+from ms_graph_service import configure_ms_graph_client
+
+# Sample MS Graph config for tests that run the real delta fetch
+TEST_GRAPH_CONFIG = {
+    "MS_GRAPH_CLIENT_ID": "test_client_id",
+    "MS_GRAPH_CLIENT_SECRET": "test_client_secret",
+    "MS_GRAPH_TENANT_ID": "test_tenant_id",
+    "MS_GRAPH_MAILBOX_USER_ID": "test_user_id"
+}
+
+# Helper to create email summaries as returned by the delta query
 def create_ms_email_summary(email_id, received_datetime_str):
     return {
         'id': email_id,
         'subject': f'Test Subject {email_id}',
         'receivedDateTime': received_datetime_str,
-        'bodyPreview': 'Test preview'
-        # Add other fields as used by poll_new_emails or classify_email_intent
+        'bodyPreview': 'Test preview',
+        'hasAttachments': False
     }
 
-class TestPollNewEmailsIntegration(unittest.TestCase):
+def create_test_app():
+    """Minimal Flask app on in-memory SQLite for the poller."""
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['POLL_INTERVAL_SECONDS'] = 60
+    app.config['POLL_MAX_INTERVAL_SECONDS'] = 600
+    db.init_app(app)
+    return app
 
-    def setUp(self):
-        # It's often good to use a test-specific configuration for Flask app in tests
-        # flask_app.config['TESTING'] = True
-        # flask_app.config['REDIS_URL'] = 'redis://localhost:6379/1' # Test Redis DB
-        # For simplicity, we'll rely on patching heavily.
-        self.app_context = flask_app.app_context()
-        self.app_context.push() # Push an app context for the duration of the test
-        
-        # Reset or manage global state like last_checked_timestamp if it's in background_tasks
-        # This might require making `last_checked_timestamp` more testable (e.g., part of a class)
-        # For now, we'll assume it can be patched or it resets appropriately.
-        patcher = patch('app.background_tasks.last_checked_timestamp', None)
-        self.mock_last_checked = patcher.start()
-        self.addCleanup(patcher.stop)
 
+class PollerDatabaseTestCase(unittest.TestCase):
+    """Runs each test in the test app's context on freshly created tables."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = create_test_app()
+
+    def setUp(self):
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
 
     def tearDown(self):
-        if self.app_context:
-            self.app_context.pop()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def _store_delta_link(self, delta_link):
+        db.session.add(PollerState(key=INBOX_DELTA_LINK_KEY, value=delta_link))
+        db.session.commit()
+
+    def _stored_delta_link(self):
+        return self._stored_state(INBOX_DELTA_LINK_KEY)
+
+    def _stored_state(self, key):
+        db.session.expire_all()
+        state = db.session.get(PollerState, key)
+        return state.value if state else None
+
+
+class TestPollNewEmailsIntegration(PollerDatabaseTestCase):
+    """poll_new_emails against a real database: delta link in PollerState, tasks in PendingTask."""
 
-    @patch('app.background_tasks.get_email_queue') # Mocks the function that returns the queue
     @patch('app.background_tasks.classify_email_intent')
-    @patch('app.background_tasks.fetch_new_emails_since') # Mock the MS Graph service call
-    def test_poll_no_new_emails(self, mock_fetch_emails, mock_classify, mock_get_queue):
-        """Test poll_new_emails when fetch_new_emails_since returns an empty list."""
-        mock_fetch_emails.return_value = []
-        mock_rq_queue = MagicMock()
-        mock_get_queue.return_value = mock_rq_queue
-        
-        poll_new_emails(flask_app) # Pass the actual app or a suitable mock
-        
-        mock_fetch_emails.assert_called_once_with(ANY) # ANY for timestamp
+    @patch('app.background_tasks.ms_fetch_email_delta')
+    def test_first_poll_starts_sync_and_stores_delta_link(self, mock_fetch_delta, mock_classify):
+        """With no stored link, a catch-up sync is started and the returned link is stored."""
+        mock_fetch_delta.return_value = ([], "delta_1")
+
+        queued = poll_new_emails(self.app)
+
+        self.assertEqual(queued, 0)
+        self.assertIsNone(mock_fetch_delta.call_args[0][0])
+        since = mock_fetch_delta.call_args[1]['since']
+        self.assertLess(since, datetime.now(timezone.utc) - timedelta(days=6))
         mock_classify.assert_not_called()
-        mock_rq_queue.enqueue.assert_not_called()
-        self.assertIsNotNone(self.mock_last_checked) # Check that last_checked_timestamp was updated
+        self.assertEqual(self._stored_delta_link(), "delta_1")
 
-    @patch('app.background_tasks.get_email_queue')
+    @patch('app.background_tasks.ms_fetch_details_and_attachments_batch')
     @patch('app.background_tasks.classify_email_intent')
-    @patch('app.background_tasks.fetch_new_emails_since')
-    def test_poll_single_email_enqueued(self, mock_fetch_emails, mock_classify, mock_get_queue):
-        """Test polling and successfully enqueueing a single email."""
-        email_time = datetime.now(timezone.utc) - timedelta(minutes=10)
-        email_summary = create_ms_email_summary("email123", email_time.isoformat())
-        mock_fetch_emails.return_value = [email_summary]
+    @patch('app.background_tasks.ms_fetch_email_delta')
+    def test_stored_delta_link_is_resumed_and_tasks_queued(self, mock_fetch_delta, mock_classify, mock_fetch_batch):
+        self._store_delta_link("delta_old")
+        email_summary = create_ms_email_summary("email123", "2024-05-01T09:30:00Z")
+        mock_fetch_delta.return_value = ([email_summary], "delta_new")
         mock_classify.return_value = "test_intent"
-        
-        mock_rq_queue = MagicMock()
-        mock_get_queue.return_value = mock_rq_queue
-        
-        poll_new_emails(flask_app)
-        
-        mock_fetch_emails.assert_called_once()
+        mock_fetch_batch.return_value = {"email123": ({"id": "email123", "body": {}}, [])}
+
+        queued = poll_new_emails(self.app)
+
+        self.assertEqual(queued, 1)
+        mock_fetch_delta.assert_called_once_with("delta_old", since=ANY)
         mock_classify.assert_called_once_with(email_summary['subject'], email_summary['bodyPreview'])
-        mock_rq_queue.enqueue.assert_called_once_with(
-            'app.background_tasks.process_email_job',
-            email_summary,
-            "test_intent",
-            job_timeout=ANY,
-            result_ttl=ANY
-        )
-        self.assertIsNotNone(self.mock_last_checked)
-
-    @patch('app.background_tasks.get_email_queue')
-    @patch('app.background_tasks.classify_email_intent')
-    @patch('app.background_tasks.fetch_new_emails_since')
-    def test_poll_multiple_emails_enqueued(self, mock_fetch_emails, mock_classify, mock_get_queue):
-        """Test polling and enqueueing multiple emails."""
-        emails_data = [
-            create_ms_email_summary("email001", (datetime.now(timezone.utc) - timedelta(minutes=5)).isoformat()),
-            create_ms_email_summary("email002", (datetime.now(timezone.utc) - timedelta(minutes=2)).isoformat())
-        ]
-        mock_fetch_emails.return_value = emails_data
-        mock_classify.side_effect = ["intent1", "intent2"]
-        
-        mock_rq_queue = MagicMock()
-        mock_get_queue.return_value = mock_rq_queue
-        
-        poll_new_emails(flask_app)
-        
-        self.assertEqual(mock_classify.call_count, 2)
-        self.assertEqual(mock_rq_queue.enqueue.call_count, 2)
-        # Check call args for the first one as an example
-        mock_rq_queue.enqueue.assert_any_call(
-            'app.background_tasks.process_email_job',
-            emails_data[0],
-            "intent1",
-            job_timeout=ANY,
-            result_ttl=ANY
-        )
-        self.assertIsNotNone(self.mock_last_checked)
-
-    @patch('app.background_tasks.get_email_queue')
+        task = db.session.scalars(db.select(PendingTask)).one()
+        self.assertEqual(task.task_type, 'process_single_email')
+        self.assertEqual(task.payload['email_summary'], email_summary)
+        self.assertEqual(task.payload['classified_intent'], "test_intent")
+        self.assertEqual(self._stored_delta_link(), "delta_new")
+
     @patch('app.background_tasks.classify_email_intent')
-    @patch('app.background_tasks.fetch_new_emails_since')
-    def test_fetch_emails_fails_timestamp_not_updated(self, mock_fetch_emails, mock_classify, mock_get_queue):
-        """Test that if fetch_new_emails_since raises an exception, timestamp is not updated."""
-        mock_fetch_emails.side_effect = Exception("MS Graph API Down")
-        mock_rq_queue = MagicMock()
-        mock_get_queue.return_value = mock_rq_queue
-        
-        # Clear the mock_last_checked before the call to see if it gets set
-        self.mock_last_checked = None 
-        # We need to re-patch it for this test case to set it to None initially before the call
-        with patch('app.background_tasks.last_checked_timestamp', None) as self.mock_last_checked_in_test:
-            with self.assertLogs(level='ERROR') as cm:
-                 poll_new_emails(flask_app)
-                 self.assertIn("Error during email polling cycle: MS Graph API Down", cm.output[0])
-            
-            mock_classify.assert_not_called()
-            mock_rq_queue.enqueue.assert_not_called()
-            self.assertIsNone(self.mock_last_checked_in_test) # Timestamp should NOT have been updated
-
-    @patch('app.background_tasks.get_email_queue')
+    @patch('app.background_tasks.ms_fetch_email_delta')
+    def test_fetch_failure_keeps_delta_link(self, mock_fetch_delta, mock_classify):
+        """A failed fetch re-raises so the poll task fails, and the stored link is left as is."""
+        self._store_delta_link("delta_old")
+        mock_fetch_delta.side_effect = Exception("MS Graph API Down")
+
+        with self.assertLogs('app.background_tasks', level='ERROR') as cm:
+            with self.assertRaises(Exception):
+                poll_new_emails(self.app)
+        self.assertIn("Error during email polling cycle: MS Graph API Down", cm.output[0])
+
+        mock_classify.assert_not_called()
+        self.assertEqual(self._stored_delta_link(), "delta_old")
+
+    @patch('app.background_tasks._upsert_poller_state')
+    @patch('app.background_tasks.ms_fetch_details_and_attachments_batch')
     @patch('app.background_tasks.classify_email_intent')
-    @patch('app.background_tasks.fetch_new_emails_since')
-    def test_classification_fails_skips_email(self, mock_fetch_emails, mock_classify, mock_get_queue):
-        """Test that if classification fails for one email, it's skipped and others are processed."""
-        emails_data = [
-            create_ms_email_summary("email_fail", (datetime.now(timezone.utc) - timedelta(minutes=5)).isoformat()),
-            create_ms_email_summary("email_ok", (datetime.now(timezone.utc) - timedelta(minutes=2)).isoformat())
-        ]
-        mock_fetch_emails.return_value = emails_data
-        mock_classify.side_effect = [Exception("Classification failed!"), "intent_ok"]
-        
-        mock_rq_queue = MagicMock()
-        mock_get_queue.return_value = mock_rq_queue
-        
-        with self.assertLogs(level='ERROR') as cm:
-            poll_new_emails(flask_app)
-            self.assertIn("Failed to classify intent for email_fail: Classification failed!", cm.output[0])
-
-        self.assertEqual(mock_classify.call_count, 2)
-        mock_rq_queue.enqueue.assert_called_once_with(
-            'app.background_tasks.process_email_job',
-            emails_data[1], # Only the second email should be enqueued
-            "intent_ok",
-            job_timeout=ANY,
-            result_ttl=ANY
-        )
-        self.assertIsNotNone(self.mock_last_checked) # Timestamp updated as the poll cycle itself succeeded
-
-    @patch('app.background_tasks.get_email_queue')
+    @patch('app.background_tasks.ms_fetch_email_delta')
+    def test_tasks_are_not_committed_without_the_delta_link(self, mock_fetch_delta, mock_classify, mock_fetch_batch, mock_upsert):
+        """Tasks and the new delta link are written in one transaction: no link, no tasks."""
+        self._store_delta_link("delta_old")
+        mock_fetch_delta.return_value = ([create_ms_email_summary("email123", "2024-05-01T09:30:00Z")], "delta_new")
+        mock_classify.return_value = "test_intent"
+        mock_fetch_batch.return_value = {}
+        mock_upsert.side_effect = Exception("Upsert failed")
+
+        with self.assertLogs('app.background_tasks', level='ERROR'):
+            with self.assertRaises(Exception):
+                poll_new_emails(self.app)
+
+        self.assertEqual(db.session.scalars(db.select(PendingTask)).all(), [])
+        self.assertEqual(self._stored_delta_link(), "delta_old")
+
+    @patch('ms_graph_service._make_graph_api_call')
+    def test_expired_delta_link_restarts_sync(self, mock_make_call):
+        """A 410 on the stored link restarts the delta sync and the fresh link replaces it."""
+        configure_ms_graph_client(MagicMock(**TEST_GRAPH_CONFIG))
+        self._store_delta_link("delta_expired")
+        gone = HTTPError(response=MagicMock(status_code=410))
+        mock_make_call.side_effect = [gone, {"value": [], "@odata.deltaLink": "delta_fresh"}]
+
+        poll_new_emails(self.app)
+
+        self.assertEqual(mock_make_call.call_args_list[0][0][1], "delta_expired")
+        restart_call = mock_make_call.call_args_list[1]
+        self.assertTrue(restart_call[0][1].endswith("/mailFolders/inbox/messages/delta"))
+        # The restart is limited to the INITIAL_POLL_CATCHUP_DAYS window
+        catchup_start = datetime.now(timezone.utc) - timedelta(days=7)
+        self.assertIn(f"receivedDateTime ge {catchup_start:%Y-%m-%d}", restart_call[1]['params']['$filter'])
+        self.assertEqual(self._stored_delta_link(), "delta_fresh")
+
+
+class TestNextPollInterval(unittest.TestCase):
+
+    def test_doubles_per_empty_poll_up_to_the_cap(self):
+        self.assertEqual(_next_poll_interval(60, 0, 600), 60)
+        self.assertEqual(_next_poll_interval(60, 1, 600), 120)
+        self.assertEqual(_next_poll_interval(60, 3, 600), 480)
+        self.assertEqual(_next_poll_interval(60, 4, 600), 600)
+        self.assertEqual(_next_poll_interval(60, 10_000, 600), 600)
+
+    def test_never_below_the_base_interval(self):
+        self.assertEqual(_next_poll_interval(900, 2, 600), 900)
+
+
+class TestPollBackoff(PollerDatabaseTestCase):
+    """Empty-poll counting in poll_new_emails and the backoff skip in the scheduled trigger."""
+
+    def _store_state(self, **values):
+        for key, value in values.items():
+            db.session.merge(PollerState(key=key, value=value))
+        db.session.commit()
+
+    @patch('app.background_tasks.ms_fetch_email_delta')
+    def test_empty_poll_increments_counter_and_backs_off(self, mock_fetch_delta):
+        self._store_state(**{EMPTY_POLLS_KEY: '2'})
+        mock_fetch_delta.return_value = ([], "delta_1")
+
+        poll_new_emails(self.app)
+
+        self.assertEqual(self._stored_state(EMPTY_POLLS_KEY), '3')
+        # 3 empty polls: next poll in 60 * 2**3 = 480s, i.e. 420s past the regular tick
+        backoff_until = datetime.fromisoformat(self._stored_state(POLL_BACKOFF_UNTIL_KEY))
+        remaining = (backoff_until - datetime.now(timezone.utc)).total_seconds()
+        self.assertAlmostEqual(remaining, 420, delta=5)
+
+    @patch('app.background_tasks.ms_fetch_details_and_attachments_batch')
     @patch('app.background_tasks.classify_email_intent')
-    @patch('app.background_tasks.fetch_new_emails_since')
-    def test_enqueue_fails_skips_email_and_logs(self, mock_fetch_emails, mock_classify, mock_get_queue):
-        """Test that if enqueuing fails for one email, it's skipped and others are processed."""
-        import redis # For redis.exceptions.ConnectionError
-        emails_data = [
-            create_ms_email_summary("email_enqueue_fail", (datetime.now(timezone.utc) - timedelta(minutes=5)).isoformat()),
-            create_ms_email_summary("email_enqueue_ok", (datetime.now(timezone.utc) - timedelta(minutes=2)).isoformat())
-        ]
-        mock_fetch_emails.return_value = emails_data
-        mock_classify.side_effect = ["intent_fail_enqueue", "intent_ok_enqueue"]
-        
-        mock_rq_queue = MagicMock()
-        # Simulate ConnectionError on the first call to enqueue, success on the second
-        mock_rq_queue.enqueue.side_effect = [redis.exceptions.ConnectionError("Redis down!"), MagicMock()]
-        mock_get_queue.return_value = mock_rq_queue
-
-        with self.assertLogs(level='ERROR') as cm:
-            poll_new_emails(flask_app)
-            self.assertIn("Redis connection error: Redis down!. Skipping email email_enqueue_fail.", cm.output[0])
-        
-        self.assertEqual(mock_classify.call_count, 2)
-        self.assertEqual(mock_rq_queue.enqueue.call_count, 2)
-        # Check that the second email was enqueued correctly
-        # The first call to enqueue raised an error, the second one should have worked.
-        # We can inspect call_args_list, the successful call would be the one that didn't raise.
-        # For simplicity, we're checking that enqueue was called twice and an error logged for the first.
-        # A more precise check would verify the arguments of the *successful* call.
-        
-        # Assert that the second email (index 1) was attempted with its corresponding intent
-        args_list = mock_rq_queue.enqueue.call_args_list
-        self.assertEqual(args_list[1][0][0], 'app.background_tasks.process_email_job')
-        self.assertEqual(args_list[1][0][1], emails_data[1])
-        self.assertEqual(args_list[1][0][2], "intent_ok_enqueue")
-
-        self.assertIsNotNone(self.mock_last_checked)
+    @patch('app.background_tasks.ms_fetch_email_delta')
+    def test_new_email_resets_counter(self, mock_fetch_delta, mock_classify, mock_fetch_batch):
+        self._store_state(**{EMPTY_POLLS_KEY: '5'})
+        mock_fetch_delta.return_value = ([create_ms_email_summary("email123", "2024-05-01T09:30:00Z")], "delta_1")
+        mock_classify.return_value = "test_intent"
+        mock_fetch_batch.return_value = {}
+
+        poll_new_emails(self.app)
+
+        self.assertEqual(self._stored_state(EMPTY_POLLS_KEY), '0')
+        backoff_until = datetime.fromisoformat(self._stored_state(POLL_BACKOFF_UNTIL_KEY))
+        self.assertLessEqual(backoff_until, datetime.now(timezone.utc))
+
+    @patch('ms_graph_service._make_graph_api_call')
+    def test_failed_fetch_is_not_counted_as_empty(self, mock_make_call):
+        """A Graph outage fails the poll task; it must not push the poller into backoff."""
+        configure_ms_graph_client(MagicMock(**TEST_GRAPH_CONFIG))
+        self._store_state(**{INBOX_DELTA_LINK_KEY: 'delta_old', EMPTY_POLLS_KEY: '1'})
+        mock_make_call.side_effect = HTTPError(response=MagicMock(status_code=503))
+
+        with self.assertLogs('app.background_tasks', level='ERROR'):
+            with self.assertRaises(HTTPError):
+                poll_new_emails(self.app)
+
+        self.assertEqual(self._stored_state(EMPTY_POLLS_KEY), '1')
+        self.assertIsNone(self._stored_state(POLL_BACKOFF_UNTIL_KEY))
+        self.assertEqual(self._stored_delta_link(), 'delta_old')
+
+    def _queued_poll_tasks(self):
+        return db.session.scalars(
+            db.select(PendingTask).where(PendingTask.task_type == 'poll_all_new_emails').order_by(PendingTask.id)
+        ).all()
+
+    @patch('app.background_tasks._scheduler_job_app')
+    def test_trigger_skips_while_backing_off(self, mock_job_app):
+        mock_job_app.return_value = self.app
+        backoff_until = datetime.now(timezone.utc) + timedelta(minutes=5)
+        self._store_state(**{POLL_BACKOFF_UNTIL_KEY: backoff_until.isoformat()})
+
+        trigger_email_polling_task_creation()
+
+        self.assertEqual(self._queued_poll_tasks(), [])
+
+    @patch('app.background_tasks._scheduler_job_app')
+    def test_trigger_waits_for_a_running_poll(self, mock_job_app):
+        mock_job_app.return_value = self.app
+        db.session.add(PendingTask(task_type='poll_all_new_emails', payload={}, status='processing',
+                                   scheduled_for=datetime.now(timezone.utc) - timedelta(minutes=1)))
+        db.session.commit()
+
+        trigger_email_polling_task_creation()
+
+        self.assertEqual(len(self._queued_poll_tasks()), 1)
+
+    @patch('app.background_tasks._scheduler_job_app')
+    def test_trigger_ignores_poll_stuck_in_processing(self, mock_job_app):
+        """A poll task orphaned by a killed worker must not stop scheduled polling for good."""
+        mock_job_app.return_value = self.app
+        db.session.add(PendingTask(task_type='poll_all_new_emails', payload={}, status='processing',
+                                   scheduled_for=datetime.now(timezone.utc) - timedelta(hours=1)))
+        db.session.commit()
+
+        trigger_email_polling_task_creation()
+
+        self.assertEqual([task.status for task in self._queued_poll_tasks()], ['processing', 'pending'])
+
+    @patch('app.background_tasks._scheduler_job_app')
+    def test_trigger_queues_poll_once_backoff_expires(self, mock_job_app):
+        mock_job_app.return_value = self.app
+        backoff_until = datetime.now(timezone.utc) - timedelta(seconds=1)
+        self._store_state(**{POLL_BACKOFF_UNTIL_KEY: backoff_until.isoformat()})
+
+        trigger_email_polling_task_creation()
+
+        self.assertEqual(len(self._queued_poll_tasks()), 1)
+
+
+class TestInsertsWithoutOnConflict(PollerDatabaseTestCase):
+    """Backends without INSERT ... ON CONFLICT fall back to plain INSERTs instead of failing."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.dict('app.background_tasks._ON_CONFLICT_INSERTS', clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_insert_ignoring_duplicates_skips_stored_keys(self):
+        db.session.add(Email(graph_id='email123'))
+        db.session.add(AttachmentMetadata(graph_id='att1', email_graph_id='email123', name='old.pdf'))
+        db.session.commit()
+
+        _insert_ignoring_duplicates(db.session, AttachmentMetadata, [
+            {"graph_id": 'att1', "email_graph_id": 'email123', "name": 'new.pdf'},
+            {"graph_id": 'att2', "email_graph_id": 'email123', "name": 'other.pdf'},
+        ])
+        db.session.commit()
+
+        names = dict(db.session.execute(db.select(AttachmentMetadata.graph_id, AttachmentMetadata.name)).all())
+        self.assertEqual(names, {'att1': 'old.pdf', 'att2': 'other.pdf'})
+
+    def test_upsert_poller_state_inserts_and_updates(self):
+        self._store_delta_link("delta_old")
+
+        _upsert_poller_state(db.session, PollerState, {INBOX_DELTA_LINK_KEY: "delta_new", EMPTY_POLLS_KEY: '0'})
+        db.session.commit()
+
+        self.assertEqual(self._stored_delta_link(), "delta_new")
+        self.assertEqual(self._stored_state(EMPTY_POLLS_KEY), '0')
+
 
 if __name__ == '__main__':
-    unittest.main() 
\ No newline at end of file
+    unittest.main()